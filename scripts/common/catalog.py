@@ -0,0 +1,142 @@
+import csv
+import hashlib
+import os
+
+from compressed import existing_path, open_binary
+
+CATALOG_NAME = 'catalog.tsv'
+
+COLUMNS = ['lemma', 'file', 'path', 'rows', 'bytes', 'sha256']
+
+# Size of the blocks read to hash a file and count its rows
+CHUNK_SIZE = 1 << 20
+
+'''
+Lists the lemma folders of a data directory by scanning it. Files in the directory (e.g. previously
+concatenated .tsv files) are skipped.
+
+INPUT: (str), a path to a data directory containing one folder per lemma.
+OUTPUT: (list), the sorted names of the lemma folders.
+'''
+def lemma_dirs(path):
+    return sorted(d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d)))
+
+'''
+Hashes a file and counts its rows in one pass. The hash is taken over the file on disk, the rows are
+counted in the decompressed content of .tsv.gz and .tsv.zst files.
+
+INPUT: (str), the path of the file on disk.
+OUTPUT: (int, str), the number of rows without the header and the sha256 hex digest.
+'''
+def _scan_file(path):
+    h = hashlib.sha256()
+    lines = 0
+    last = b'\n'
+    compressed = not path.endswith('.tsv')
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+            if not compressed:
+                lines += chunk.count(b'\n')
+                last = chunk[-1:]
+    if compressed:
+        with open_binary(path) as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                lines += chunk.count(b'\n')
+                last = chunk[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0), h.hexdigest()
+
+'''
+Reads the catalog of a data directory.
+
+INPUT: (str), a path to a data directory.
+OUTPUT: (list), the catalog entries with integer rows and bytes, or None if the directory has no catalog.
+'''
+def read_catalog(path):
+    catalog_path = os.path.join(path, CATALOG_NAME)
+    if not os.path.exists(catalog_path):
+        return None
+    with open(catalog_path, 'r', newline='') as f:
+        entries = list(csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE))
+    for entry in entries:
+        entry['rows'] = int(entry['rows'])
+        entry['bytes'] = int(entry['bytes'])
+    return entries
+
+'''
+Writes the catalog of a data directory: one entry per file of every lemma folder with the path of the file
+relative to the data directory (e.g. bag_nn/uses.tsv.gz), its number of rows, its size on disk and its sha256
+digest. Entries of lemmas that are not in changed are taken over from the previous catalog if their file still
+has the same size, so only the files written by the current run are read.
+
+INPUT: (str, list, list, list), a path to a data directory, the names of the files (e.g. ['uses.tsv']), the lemma
+folders and optionally the lemmas whose files were written since the previous catalog (all lemmas by default).
+OUTPUT: (list), the catalog entries.
+'''
+def write_catalog(path, file_names, lemmas, changed=None):
+    previous = {(e['lemma'], e['path']): e for e in read_catalog(path) or []}
+    changed = None if changed is None else set(changed)
+
+    entries = []
+    for lemma in sorted(lemmas):
+        for file_name in file_names:
+            found = existing_path(os.path.join(path, lemma, file_name))
+            if found is None:
+                continue
+            rel_path = os.path.relpath(found, path).replace(os.sep, '/')
+            size = os.path.getsize(found)
+            entry = previous.get((lemma, rel_path))
+            if entry is None or entry['bytes'] != size or changed is None or lemma in changed:
+                rows, digest = _scan_file(found)
+                entry = {'lemma': lemma, 'file': file_name, 'path': rel_path, 'rows': rows,
+                         'bytes': size, 'sha256': digest}
+            entries.append(entry)
+
+    catalog_path = os.path.join(path, CATALOG_NAME)
+    with open(catalog_path + '.tmp', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, delimiter='\t', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(entries)
+    os.replace(catalog_path + '.tmp', catalog_path)
+    return entries
+
+'''
+Lists the lemma folders of a data directory from its catalog, so that the directory is not scanned. Directories
+without a catalog (e.g. written by an older converter) are scanned instead.
+
+INPUT: (str), a path to a data directory.
+OUTPUT: (list), the sorted names of the lemma folders.
+'''
+def catalog_lemmas(path):
+    entries = read_catalog(path)
+    if entries is None:
+        return lemma_dirs(path)
+    return sorted({entry['lemma'] for entry in entries})
+
+'''
+Orders the lemma folders of a data directory for processing, largest first by the size of the given files in the
+catalog. Handing the largest lemmas to a pool of workers first keeps one large lemma from being started last and
+delaying the end of the run. Without a catalog the lemmas are returned in name order.
+
+INPUT: (str, list), a path to a data directory and optionally the names of the files whose sizes count (all files
+by default).
+OUTPUT: (list), the (lemma, bytes) pairs, largest first.
+'''
+def plan_lemmas(path, file_names=None):
+    entries = read_catalog(path)
+    if entries is None:
+        return [(lemma, 0) for lemma in lemma_dirs(path)]
+    sizes = {}
+    for entry in entries:
+        sizes.setdefault(entry['lemma'], 0)
+        if file_names is None or entry['file'] in file_names:
+            sizes[entry['lemma']] += entry['bytes']
+    return sorted(sizes.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,218 @@
+import gzip
+import io
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+# zstandard is optional, .tsv.zst files can only be read and written if it is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The variants of a .tsv file, looked up in this order
+SUFFIXES = ['', '.gz', '.zst']
+
+# Compression of newly written .tsv files: '' (none), 'gz' or 'zst'
+DEFAULT_COMPRESSION = os.environ.get('ANNOTATION_TSV_COMPRESSION', '')
+
+# Size of the blocks decompressed ahead of the reader and the number of blocks buffered
+CHUNK_SIZE = 1 << 20
+READ_AHEAD = 4
+
+'''
+Returns the file a .tsv path refers to: the plain file if it exists, otherwise its .gz or .zst variant.
+
+INPUT: (str), the path of the .tsv file (e.g. data/uses.tsv).
+OUTPUT: (str), the path of the existing file (e.g. data/uses.tsv.gz), or None.
+'''
+def existing_path(path):
+    for suffix in SUFFIXES:
+        if os.path.exists(path + suffix):
+            return path + suffix
+    return None
+
+def exists(path):
+    return existing_path(path) is not None
+
+'''
+Returns the path a .tsv file is written to with a compression.
+
+INPUT: (str, str), the path of the .tsv file and the compression ('', 'gz' or 'zst'), DEFAULT_COMPRESSION by default.
+OUTPUT: (str), the path of the file to write.
+'''
+def output_path(path, compression=None):
+    if compression is None:
+        compression = DEFAULT_COMPRESSION
+    if compression not in ('', 'gz', 'zst'):
+        raise ValueError(f"Unknown compression '{compression}', choose from '', 'gz' and 'zst'.")
+    return path + ('.' + compression if compression else '')
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError('Reading and writing .zst files requires zstandard (pip install zstandard).')
+
+
+class ReadAheadReader(io.RawIOBase):
+    '''
+    Reads a stream in a background thread, a few blocks ahead of the consumer. Decompression then runs
+    while the previous blocks are parsed (zlib and zstd release the GIL while they decompress).
+    '''
+
+    def __init__(self, raw, chunk_size=CHUNK_SIZE, read_ahead=READ_AHEAD):
+        self._raw = raw
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=read_ahead)
+        self._stop = threading.Event()
+        self._buffer = b''
+        self._eof = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                chunk = self._raw.read(self._chunk_size)
+                self._put(chunk)
+                if not chunk:
+                    return
+        except BaseException as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._eof:
+            item = self._queue.get()
+            if isinstance(item, BaseException):
+                raise item
+            if not item:
+                self._eof = True
+            self._buffer = item
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._raw.close()
+        super().close()
+
+
+def _open_codec(path, mode, codec, name=None):
+    if codec == 'gz':
+        if name is not None:
+            # the name stored in the gzip header, e.g. for a temporary file
+            return gzip.GzipFile(filename=name, mode=mode, fileobj=open(path, mode))
+        return gzip.open(path, mode)
+    if codec == 'zst':
+        _require_zstandard()
+        if mode == 'rb':
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+    return open(path, mode)
+
+def _codec(path):
+    for codec in ('gz', 'zst'):
+        if path.endswith('.' + codec):
+            return codec
+    return ''
+
+'''
+Opens a .tsv file for reading as bytes, decompressing .gz and .zst variants in a background thread.
+
+INPUT: (str), the path of the .tsv file; its compressed variants are found automatically.
+OUTPUT: (io.BufferedIOBase), the opened file.
+'''
+def open_binary(path):
+    found = existing_path(path) or path
+    codec = _codec(found)
+    if not codec:
+        return open(found, 'rb')
+    return io.BufferedReader(ReadAheadReader(_open_codec(found, 'rb', codec)), buffer_size=CHUNK_SIZE)
+
+'''
+Opens a .tsv file as text. Files are read like open_binary() and written with the given compression, in
+which case other variants of the file are removed so that they are not read instead.
+
+INPUT: (str, str, str), the path of the .tsv file, the mode ('r' or 'w') and the compression for writing.
+OUTPUT: (io.TextIOWrapper), the opened file.
+'''
+def open_text(path, mode='r', compression=None):
+    if mode == 'r':
+        return io.TextIOWrapper(open_binary(path), encoding='utf-8', newline='')
+    out_path = output_path(path, compression)
+    _remove_variants(path, keep=out_path)
+    return io.TextIOWrapper(_open_codec(out_path, 'wb', _codec(out_path)), encoding='utf-8', newline='')
+
+def _remove_variants(path, keep):
+    for suffix in SUFFIXES:
+        if path + suffix != keep and os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+'''
+Writes a .tsv file atomically: the content is written to a temporary file with the given compression, which
+replaces the file (and any other variant of it) once it is complete.
+
+INPUT: (str, str), the path of the .tsv file and the compression.
+OUTPUT: (contextmanager), yields the binary file to write to.
+'''
+@contextmanager
+def atomic_writer(path, compression=None):
+    out_path = output_path(path, compression)
+    tmp_path = out_path + '.tmp'
+    f = _open_codec(tmp_path, 'wb', _codec(out_path), name=os.path.basename(path))
+    try:
+        yield f
+        f.close()
+    except BaseException:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, out_path)
+    _remove_variants(path, keep=out_path)
+
+'''
+Writes several .tsv files that replace their files together: every file is written to a temporary file like in
+atomic_writer(), and the temporary files replace the files only once all of them are complete. If writing any of
+them fails, the temporary files are removed and no file is changed.
+
+INPUT: (None)
+OUTPUT: (contextmanager), yields a function that takes the path of a .tsv file and the compression and returns a
+context manager yielding the binary file to write to.
+'''
+@contextmanager
+def staged_writers():
+    staged = []
+
+    @contextmanager
+    def writer(path, compression=None):
+        out_path = output_path(path, compression)
+        tmp_path = out_path + '.tmp'
+        staged.append((path, out_path, tmp_path))
+        with _open_codec(tmp_path, 'wb', _codec(out_path), name=os.path.basename(path)) as f:
+            yield f
+
+    try:
+        yield writer
+    except BaseException:
+        for path, out_path, tmp_path in staged:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+    for path, out_path, tmp_path in staged:
+        os.replace(tmp_path, out_path)
+        _remove_variants(path, keep=out_path)
@@ -0,0 +1,167 @@
+import hashlib
+import mmap
+import os
+import threading
+
+import numpy as np
+
+# The files of a context store: the UTF-8 contexts back to back and the sorted index of their hashes
+BLOB_NAME = 'contexts.bin'
+INDEX_NAME = 'contexts.index.npy'
+
+# The column of a uses.tsv file that references its context in a store instead of containing it
+REF_COLUMN = 'context_ref'
+
+INDEX_DTYPE = np.dtype([('key', 'S16'), ('offset', '<u8'), ('length', '<u4')])
+
+# One store object per directory and process, shared by all readers and writers of the process
+_stores = {}
+_stores_lock = threading.Lock()
+
+'''
+Hashes a context to its key, a 16 byte BLAKE2b hash of the UTF-8 text. The reference written to the uses.tsv
+files is the hex form of the key.
+
+INPUT: (bytes), the encoded context.
+OUTPUT: (bytes), the 16 byte key.
+'''
+def _key(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class ContextStore:
+    '''
+    Stores every distinct context once, e.g. the contexts shared by the LEXSUB, WSBEST and WSSIM trees or by
+    the DWUG pair and sense trees. Contexts are appended to contexts.bin and found through contexts.index.npy,
+    which holds the hash, offset and length of every context sorted by hash. Both files are memory-mapped, so
+    lookups do not read the files and the pages are shared by all processes reading the same store.
+
+    Only one process should add contexts to a store at a time; threads of that process may add concurrently.
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._state = self._load()
+
+    def _load(self):
+        # the index and the blob are swapped together, so a lookup never sees an index without its contexts;
+        # mappings that are replaced are closed once no view of them is left
+        index = np.zeros(0, dtype=INDEX_DTYPE)
+        blob = b''
+        index_path = os.path.join(self._path, INDEX_NAME)
+        if os.path.exists(index_path):
+            index = np.load(index_path, mmap_mode='r')
+        blob_path = os.path.join(self._path, BLOB_NAME)
+        if os.path.exists(blob_path) and os.path.getsize(blob_path) > 0:
+            with open(blob_path, 'rb') as f:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return index, blob
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def _positions(self, index, keys):
+        positions = np.searchsorted(index['key'], keys)
+        found = positions < len(index)
+        found[found] = index['key'][positions[found]] == keys[found]
+        return positions, found
+
+    def add(self, contexts):
+        '''Adds contexts to the store and returns their references. Contexts that are already stored are
+        not added again.'''
+        encoded = [context.encode('utf-8') for context in contexts]
+        keys = [_key(data) for data in encoded]
+        with self._lock:
+            index = self._state[0]
+            positions, found = self._positions(index, np.array(keys, dtype='S16'))
+            new = {}
+            for key, data, stored in zip(keys, encoded, found.tolist()):
+                if not stored and key not in new:
+                    new[key] = data
+            if new:
+                self._append(index, new)
+        return [key.hex() for key in keys]
+
+    def _append(self, index, new):
+        os.makedirs(self._path, exist_ok=True)
+        # contexts are only ever appended, so readers holding the old index stay valid
+        with open(os.path.join(self._path, BLOB_NAME), 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            records = np.zeros(len(new), dtype=INDEX_DTYPE)
+            for i, (key, data) in enumerate(new.items()):
+                records[i] = (key, offset, len(data))
+                offset += len(data)
+            f.write(b''.join(new.values()))
+
+        index = np.concatenate([np.asarray(index), records])
+        index = index[np.argsort(index['key'], kind='stable')]
+        index_path = os.path.join(self._path, INDEX_NAME)
+        with open(index_path + '.tmp', 'wb') as f:
+            np.save(f, index)
+        os.replace(index_path + '.tmp', index_path)
+        self._state = self._load()
+
+    def view(self, ref):
+        '''Returns the UTF-8 bytes of a context as a memoryview of the mapped blob, without copying them.'''
+        index, blob = self._state
+        positions, found = self._positions(index, np.array([bytes.fromhex(ref)], dtype='S16'))
+        if not found[0]:
+            raise KeyError(f"Context '{ref}' is not in the store at '{self._path}'.")
+        offset, length = int(index['offset'][positions[0]]), int(index['length'][positions[0]])
+        return memoryview(blob)[offset:offset + length]
+
+    def resolve(self, refs):
+        '''Returns the contexts of a list of references, looked up in one vectorized search.'''
+        refs = list(refs)
+        index, blob = self._state
+        positions, found = self._positions(index, np.array([bytes.fromhex(ref) for ref in refs], dtype='S16'))
+        if not found.all():
+            missing = refs[int(np.flatnonzero(~found)[0])]
+            raise KeyError(f"Context '{missing}' is not in the store at '{self._path}'.")
+        offsets = index['offset'][positions].tolist()
+        lengths = index['length'][positions].tolist()
+        return [blob[offset:offset + length].decode('utf-8') for offset, length in zip(offsets, lengths)]
+
+'''
+Opens the context store in a directory. The store is opened once per process; later calls return the same object.
+
+INPUT: (str), the directory of the store.
+OUTPUT: (ContextStore), the store.
+'''
+def open_store(path):
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ContextStore(path)
+        return _stores[path]
+
+'''
+Finds the context store of a .tsv file: the nearest directory above the file that contains a contexts.index.npy,
+e.g. the output directory of transform_mc.py for the uses of its lexsub, wsbest and wssim trees.
+
+INPUT: (str), the path of the .tsv file.
+OUTPUT: (ContextStore), the store.
+'''
+def find_store(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    while True:
+        if os.path.exists(os.path.join(directory, INDEX_NAME)):
+            return open_store(directory)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            raise FileNotFoundError(f"'{path}' references its contexts, but no directory above it contains a context store.")
+        directory = parent
+
+'''
+Adds the contexts of a uses table to a store and replaces its context column by a context_ref column at the same
+position.
+
+INPUT: (pandas.DataFrame, ContextStore), the uses and the store.
+OUTPUT: (pandas.DataFrame), the uses referencing their contexts.
+'''
+def externalize(uses, store):
+    uses = uses.copy()
+    position = uses.columns.get_loc('context')
+    uses.insert(position, REF_COLUMN, store.add(uses.pop('context').tolist()))
+    return uses
@@ -0,0 +1,243 @@
+import csv
+import hashlib
+import os
+import sys
+from urllib.parse import urlparse, unquote
+from urllib.request import url2pathname
+
+import requests
+
+# Size of the blocks streamed from the network to disk
+CHUNK_SIZE = 1 << 20
+
+# Archives are stored by the sha256 of their content below this directory
+DEFAULT_CACHE_DIR = os.environ.get('ANNOTATION_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'annotation_standardization'))
+
+# A local directory holding copies of the archives, looked up by file name before downloading
+DEFAULT_MIRROR = os.environ.get('ANNOTATION_MIRROR')
+
+# The known checksums of the archives the tools download, one url and "algorithm:hexdigest" per row
+CHECKSUMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checksums.tsv')
+
+'''
+Parses a checksum of the form "algorithm:hexdigest" (e.g. "md5:0cc175b9c0f1b6a831c399e269772661").
+
+INPUT: (str), the checksum string, or None.
+OUTPUT: (tuple), the hashlib algorithm name and the lower-case hex digest, or None.
+'''
+def parse_checksum(checksum):
+    if checksum is None:
+        return None
+    algorithm, sep, digest = checksum.partition(':')
+    if not sep or algorithm not in hashlib.algorithms_available:
+        raise ValueError(f"Checksum '{checksum}' is not of the form 'algorithm:hexdigest'.")
+    return algorithm, digest.lower()
+
+'''
+Looks up the known checksum of a url in checksums.tsv.
+
+INPUT: (str, str), the url and the path of the checksums file (common/checksums.tsv by default).
+OUTPUT: (str), the checksum of the form "algorithm:hexdigest", or None if the url has none.
+'''
+def known_checksum(url, path=None):
+    path = path or CHECKSUMS_PATH
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            if row['url'] == url and row['checksum']:
+                return row['checksum']
+    return None
+
+'''
+Records the checksum of a url in checksums.tsv, so that later downloads of the url are verified against it.
+
+INPUT: (str, str, str), the url, the checksum of the form "algorithm:hexdigest" and the path of the checksums file
+(common/checksums.tsv by default).
+OUTPUT: (bool), whether the checksum was recorded (False if the file cannot be written).
+'''
+def pin_checksum(url, checksum, path=None):
+    path = path or CHECKSUMS_PATH
+    try:
+        new = not os.path.exists(path)
+        with open(path, 'a', newline='') as f:
+            writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+            if new:
+                writer.writerow(['url', 'checksum'])
+            writer.writerow([url, checksum])
+    except OSError:
+        return False
+    return True
+
+'''
+Hashes a file in chunks.
+
+INPUT: (str, list), a path to a file and the hashlib algorithm names to compute.
+OUTPUT: (dict), the hex digest per algorithm.
+'''
+def hash_file(path, algorithms=('sha256',), chunk_size=CHUNK_SIZE):
+    hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            for h in hashes.values():
+                h.update(chunk)
+    return {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
+
+'''
+Raises a ValueError if the digests of a file do not match the expected checksum.
+
+INPUT: (dict, tuple, str), the computed hex digests, the parsed checksum and the source for the error message.
+OUTPUT: (None)
+'''
+def verify(digests, expected, source):
+    if expected is not None and digests[expected[0]] != expected[1]:
+        raise ValueError(f"Checksum mismatch for '{source}': expected {expected[0]}:{expected[1]}, "
+                         f"got {expected[0]}:{digests[expected[0]]}.")
+
+'''
+Returns the local path of a url if it points to the local file system (file:// urls, plain paths or
+a file of the same name in the mirror directory), otherwise None.
+
+INPUT: (str, str), the url and an optional mirror directory.
+OUTPUT: (str), the local path or None.
+'''
+def local_path(url, mirror=None):
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        return url2pathname(unquote(parsed.path))
+    if parsed.scheme == '' and os.path.exists(url):
+        return url
+    if mirror is not None:
+        candidate = os.path.join(mirror, os.path.basename(unquote(parsed.path)))
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def _validator(headers):
+    # a strong ETag or the Last-Modified date identifies the version of the remote file for If-Range
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+'''
+Streams a url to a partial file. The ETag or Last-Modified date of the response is stored next to the partial file
+(<key>.part.validator), and an interrupted download is resumed with a conditional range request (If-Range): the
+server only sends the missing bytes if the remote file is still the same version, and the whole file otherwise.
+Partial files without a validator are downloaded again from the start.
+
+INPUT: (str, str, requests.Session), the url, the path of the partial file and the session to use.
+OUTPUT: (None), the complete content is in the partial file afterwards.
+'''
+def _stream_to_part(url, part_path, session, chunk_size=CHUNK_SIZE):
+    validator_path = part_path + '.validator'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = None
+    if offset and os.path.exists(validator_path):
+        with open(validator_path, 'r') as f:
+            validator = f.read().strip() or None
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if validator else {}
+
+    with session.get(url, stream=True, headers=headers, timeout=60) as req:
+        if req.status_code == 416:
+            # A partial file of the full remote size is complete (e.g. the run stopped before it was moved to the
+            # cache), otherwise it is not a prefix of the remote file and the download starts over
+            if req.headers.get('Content-Range', '') == f'bytes */{offset}':
+                return
+            os.remove(part_path)
+            if os.path.exists(validator_path):
+                os.remove(validator_path)
+            return _stream_to_part(url, part_path, session, chunk_size)
+        req.raise_for_status()
+        resume = bool(headers) and req.status_code == 206
+        if resume and (not req.headers.get('Content-Range', '').startswith(f'bytes {offset}-')
+                       or _validator(req.headers) not in (None, validator)):
+            # the range is not the rest of the partial file, or it is from another version of the remote file
+            os.remove(part_path)
+            os.remove(validator_path)
+            return _stream_to_part(url, part_path, session, chunk_size)
+        if not resume:
+            # a 200 response (the remote file changed or ranges are not supported) is the whole file
+            new_validator = _validator(req.headers)
+            if new_validator:
+                with open(validator_path, 'w') as f:
+                    f.write(new_validator)
+            elif os.path.exists(validator_path):
+                os.remove(validator_path)
+        with open(part_path, 'ab' if resume else 'wb') as f:
+            for chunk in req.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+'''
+Returns a local path to the content of a url. Remote files are streamed to disk in chunks, so memory
+use does not depend on the size of the archive. Downloads are resumed if a partial file exists and are
+stored in a content-addressed cache directory (blobs/sha256/<digest>), so later runs do not download
+them again. file:// urls, local paths and files found in the mirror directory are used in place. Without a
+checksum, the checksum of the url in checksums.tsv is verified; the sha256 of the first download of a url
+without a known checksum is recorded there, so every later download of it is verified.
+
+INPUT: (str, str, str, str, requests.Session), the url, an optional checksum of the form "algorithm:hexdigest",
+the cache directory, an optional mirror directory and an optional session for connection reuse.
+OUTPUT: (str), the path to the verified local file.
+'''
+def fetch(url, checksum=None, cache_dir=None, mirror=None, session=None):
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    mirror = mirror or DEFAULT_MIRROR
+    checksum = checksum or known_checksum(url)
+    expected = parse_checksum(checksum)
+    algorithms = {'sha256'} | ({expected[0]} if expected else set())
+
+    path = local_path(url, mirror)
+    if path is not None:
+        if expected is not None:
+            verify(hash_file(path, algorithms), expected, path)
+        return path
+
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    ref_path = os.path.join(cache_dir, 'refs', key)
+    part_path = os.path.join(cache_dir, 'partial', key + '.part')
+    blob_dir = os.path.join(cache_dir, 'blobs', 'sha256')
+
+    # Cached from an earlier run
+    if os.path.exists(ref_path):
+        with open(ref_path, 'r') as f:
+            blob_path = os.path.join(blob_dir, f.read().strip())
+        if os.path.exists(blob_path):
+            if expected is not None and expected[0] != 'sha256':
+                verify(hash_file(blob_path, algorithms), expected, blob_path)
+            elif expected is not None:
+                verify({'sha256': os.path.basename(blob_path)}, expected, blob_path)
+            return blob_path
+
+    for d in (os.path.dirname(ref_path), os.path.dirname(part_path), blob_dir):
+        os.makedirs(d, exist_ok=True)
+
+    if session is None:
+        with requests.Session() as session:
+            _stream_to_part(url, part_path, session)
+    else:
+        _stream_to_part(url, part_path, session)
+
+    digests = hash_file(part_path, algorithms)
+    try:
+        verify(digests, expected, url)
+    except ValueError:
+        os.remove(part_path)
+        if os.path.exists(part_path + '.validator'):
+            os.remove(part_path + '.validator')
+        raise
+
+    if expected is None and not pin_checksum(url, f"sha256:{digests['sha256']}"):
+        print(f"No known checksum for '{url}', downloaded sha256:{digests['sha256']}", file=sys.stderr)
+    blob_path = os.path.join(blob_dir, digests['sha256'])
+    os.replace(part_path, blob_path)
+    if os.path.exists(part_path + '.validator'):
+        os.remove(part_path + '.validator')
+    with open(ref_path, 'w') as f:
+        f.write(digests['sha256'])
+
+    return blob_path
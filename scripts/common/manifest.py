@@ -0,0 +1,103 @@
+import csv
+import hashlib
+import os
+
+from compressed import existing_path
+
+MANIFEST_NAME = 'manifest.tsv'
+
+COLUMNS = ['lemma', 'file', 'version', 'source', 'output']
+
+'''
+Hashes a file in chunks.
+
+INPUT: (str), a path to a file.
+OUTPUT: (str), the sha256 hex digest of the file content.
+'''
+def hash_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+'''
+Hashes the content of a pandas dataframe, e.g. the rows of one lemma a .tsv file is generated from.
+
+INPUT: (pandas.DataFrame), the dataframe.
+OUTPUT: (str), the sha256 hex digest of the column names and values.
+'''
+def hash_frame(df):
+    import pandas as pd
+    h = hashlib.sha256('\t'.join(str(c) for c in df.columns).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+'''
+Hashes a list of strings, e.g. the digests of the source files of a lemma.
+
+INPUT: (list), the strings.
+OUTPUT: (str), the sha256 hex digest.
+'''
+def hash_strings(strings):
+    return hashlib.sha256('\n'.join(strings).encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    '''
+    Records for every generated .tsv file of a data directory the converter version and a digest of the
+    source data it was generated from, together with the digest of the generated file. A converter run
+    can then skip the lemmas whose sources, converter version and outputs are unchanged.
+
+    The manifest is stored as manifest.tsv in the data directory.
+    '''
+
+    def __init__(self, path, version):
+        self._path = path
+        self._version = str(version)
+        self._entries = {}
+        manifest_path = os.path.join(self._path, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', newline='') as f:
+                for row in csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                    self._entries[(row['lemma'], row['file'])] = row
+
+    def is_current(self, lemma, file_names, source):
+        '''Checks whether the files of a lemma were generated from the given source digest by the current
+        converter version and have not been modified since.'''
+        if isinstance(file_names, str):
+            file_names = [file_names]
+        for file_name in file_names:
+            entry = self._entries.get((lemma, file_name))
+            if entry is None or entry['version'] != self._version or entry['source'] != source:
+                return False
+            # the output may have been written compressed, e.g. as judgments.tsv.gz
+            output = existing_path(os.path.join(self._path, lemma, file_name))
+            if output is None or hash_file(output) != entry['output']:
+                return False
+        return True
+
+    def record(self, lemma, file_names, source):
+        '''Records that the files of a lemma were generated from the given source digest.'''
+        if isinstance(file_names, str):
+            file_names = [file_names]
+        for file_name in file_names:
+            self._entries[(lemma, file_name)] = {
+                'lemma': lemma,
+                'file': file_name,
+                'version': self._version,
+                'source': source,
+                'output': hash_file(existing_path(os.path.join(self._path, lemma, file_name))),
+            }
+
+    def save(self):
+        '''Writes the manifest to manifest.tsv in the data directory.'''
+        manifest_path = os.path.join(self._path, MANIFEST_NAME)
+        with open(manifest_path + '.tmp', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS, delimiter='\t', lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(self._entries[key] for key in sorted(self._entries))
+        os.replace(manifest_path + '.tmp', manifest_path)
@@ -0,0 +1,179 @@
+import os
+import re
+import tarfile
+import xml.etree.ElementTree as et
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+from catalog import write_catalog
+from context_store import externalize, open_store
+from download import fetch
+from manifest import Manifest
+from partition import write_partitions
+from table_io import convert_tree
+
+# Shared by the LEXSUB, WSBEST and WSSIM transforms, which all use the uses of lexsub_wcdata.xml
+MC_URL = 'http://www.dianamccarthy.co.uk/downloads/WordMeaningAnno2012/cl-meaningincontext.tgz'
+XML_FILE = 'Data/lexsub_wcdata.xml'
+# Known errors in the source data, repaired while lexsub_wcdata.xml is read
+XML_REPAIRS = [(b'&#8221 ;', b'&#8221;')]
+# Tables whose files keep the lemma column
+LEMMA_COLUMN_TABLES = {'uses', 'senses'}
+USE_COLUMNS = ['dataID', 'context', 'indices_target_token', 'indices_target_sentence', 'lemma']
+
+#####################################################################################################################
+# Download the data
+def get_mc_data(url, path):
+    with tarfile.open(fetch(url), mode='r') as file:
+        file.extractall(path)
+
+
+class RepairReader:
+    '''
+    A read-only file-like wrapper that replaces byte patterns while a file is read, e.g. to repair broken entities
+    of an xml file before the parser sees them. The file is never read or rewritten as a whole: the last bytes of
+    each chunk are held back until the next read, so that patterns split across chunk boundaries are repaired too.
+    '''
+
+    def __init__(self, raw, repairs, chunk_size=1 << 16):
+        self._raw = raw
+        self._repairs = dict(repairs)
+        self._pattern = re.compile(b'|'.join(re.escape(p) for p in sorted(self._repairs, key=len, reverse=True)))
+        self._keep = max(len(p) for p in self._repairs) - 1
+        self._chunk_size = chunk_size
+        self._pending = b''
+        self._out = b''
+        self._eof = False
+
+    def _fill(self):
+        data = self._pending + self._raw.read(self._chunk_size)
+        if len(data) == len(self._pending):
+            self._eof = True
+            cut = len(data)
+        else:
+            # a match starting before cut is complete in data, later ones are found in the next read
+            cut = len(data) - self._keep
+        out = []
+        pos = 0
+        for m in self._pattern.finditer(data):
+            if m.start() >= cut:
+                break
+            out.append(data[pos:m.start()])
+            out.append(self._repairs[m.group()])
+            pos = m.end()
+        end = max(pos, cut)
+        out.append(data[pos:end])
+        self._out += b''.join(out)
+        self._pending = data[end:]
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._out) < size):
+            self._fill()
+        if size < 0:
+            size = len(self._out)
+        data, self._out = self._out[:size], self._out[size:]
+        return data
+
+    def close(self):
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+'''
+Opens lexsub_wcdata.xml for parsing with the known errors of the source data repaired on the fly.
+
+INPUT: (str, list), the path to the xml file and the (pattern, replacement) byte pairs to apply.
+OUTPUT: (RepairReader), the opened file.
+'''
+def open_xml(xml_file, repairs=XML_REPAIRS):
+    return RepairReader(open(xml_file, 'rb'), repairs)
+
+#####################################################################################################################
+# Make the uses
+'''
+Reads the context pieces of an <instance> element, i.e. T0 to T4 of
+<context>T0<targetsentence>T1<head>T2</head>T3</targetsentence>T4</context>, from the text and tail fields of its
+children. The pieces are
+stripped and XML-escaped as they were when the uses were cut out of the serialized element, so the contexts and
+spans do not change.
+
+INPUT: (xml.etree.ElementTree.Element), the <instance> element.
+OUTPUT: (list), the five context pieces.
+'''
+def use_pieces(use):
+    context = use.find('context')
+    sentence = context.find('targetsentence')
+    head = sentence.find('head')
+    return [escape((text or '').strip()) for text in (context.text, sentence.text, head.text, head.tail, sentence.tail)]
+
+'''
+Streams the uses of lexsub_wcdata.xml. Elements are freed as soon as they are read, so memory use does not
+depend on the size of the file, and the target token and target sentence spans are computed from the lengths
+of the context pieces.
+
+INPUT: (str or file-like), the xml file; a path is opened with open_xml.
+OUTPUT: (generator), a (dataID, context, indices_target_token, indices_target_sentence, lemma) tuple per use.
+'''
+def iter_uses(xml_file):
+    if isinstance(xml_file, str):
+        with open_xml(xml_file) as f:
+            yield from iter_uses(f)
+        return
+    root = None
+    lemma = None
+    for event, elem in et.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            elif elem.tag == 'lexelt':
+                lemma = elem.attrib['item']
+            continue
+        if elem.tag == 'instance':
+            before, left, target, right, after = use_pieces(elem)
+            sentence_start = len(before) + 1
+            target_start = sentence_start + len(left) + 1
+            target_end = target_start + len(target) + 1
+            sentence_end = sentence_start + len(left) + len(target) + len(right) + 2
+            yield (elem.attrib['id'], ' '.join((before, left, target, right, after)),
+                   f'{target_start}:{target_end}', f'{sentence_start}:{sentence_end}', lemma)
+            elem.clear()
+        elif elem.tag == 'lexelt':
+            root.clear()
+
+def parse_uses(xml_file):
+    return pd.DataFrame(iter_uses(xml_file), columns=USE_COLUMNS)
+
+#####################################################################################################################
+# Write the tables
+'''
+Writes the tables of a McCarthy transform to one .tsv file per lemma folder and to the combined files in the
+data directory, e.g. data/<lemma>/judgments.tsv and data/judgments.tsv, and lists the lemma files in
+data/catalog.tsv. Every table is written once from memory; lemmas whose rows did not change since the last run
+are not written to their lemma folder again.
+
+INPUT: (dict, str, str, bool, bool, str), the tables by name (e.g. {'uses': ..., 'judgments': ...}) with a lemma
+column, the data directory, the converter version, whether to write a row-offset index next to the combined files,
+whether to write Parquet copies of the .tsv files and optionally the directory of a context store to move the
+contexts of the uses to.
+OUTPUT: (None)
+'''
+def write_tables(tables, path, version, index=False, parquet=False, context_store=None):
+    os.makedirs(path, exist_ok=True)
+    if context_store is not None:
+        tables = dict(tables, uses=externalize(tables['uses'], open_store(context_store)))
+    manifest = Manifest(path, version)
+    lemmas = set()
+    written = set()
+    for name, table in tables.items():
+        lemmas.update(table['lemma'].unique())
+        written.update(write_partitions(table, path, name + '.tsv', manifest, keep_key=name in LEMMA_COLUMN_TABLES,
+                                        concat=True, index=index))
+    manifest.save()
+    write_catalog(path, [name + '.tsv' for name in tables], lemmas, written)
+    if parquet:
+        convert_tree(path, [name + '.tsv' for name in tables])
@@ -0,0 +1,62 @@
+import csv
+import os
+from contextlib import ExitStack
+
+from compressed import atomic_writer
+from manifest import hash_frame
+from tsv_concat import index_path, write_index
+
+'''
+Writes the rows of a dataframe to one .tsv file per lemma folder (e.g. <path>/<lemma>/judgments.tsv). The
+dataframe is grouped once instead of being scanned for every lemma, and all files are written with minimal quoting
+(csv.QUOTE_MINIMAL), which the tools read back, each lemma with a single write. Files are compressed as set by
+ANNOTATION_TSV_COMPRESSION (see compressed.py). Lemmas whose rows did not change since the last run are
+skipped if a manifest is given.
+
+With concat, the rows of all lemmas are also written to a combined file in the data directory (e.g.
+<path>/judgments.tsv) in the same pass, so the lemma files do not have to be read again to concatenate them.
+
+INPUT: (pandas.DataFrame, str, str, Manifest, str, bool, bool, bool), the dataframe, the data directory, the name
+of the files, an optional manifest, the column to partition by, whether that column is written to the files,
+whether to write the combined file and whether to write a row-offset index next to it.
+OUTPUT: (list), the lemmas whose file was written.
+'''
+def write_partitions(df, path, file_name, manifest=None, by='lemma', keep_key=False, concat=False, index=False):
+    written = []
+    entries = []
+    rows = 0
+    offset = 0
+
+    with ExitStack() as stack:
+        out = stack.enter_context(atomic_writer(os.path.join(path, file_name))) if concat else None
+        for lemma, part in df.groupby(by, sort=True):
+            if not keep_key:
+                part = part.drop(columns=by)
+            data = part.to_csv(sep='\t', quoting=csv.QUOTE_MINIMAL, index=False).encode('utf-8')
+
+            if out is not None:
+                header_end = data.index(b'\n') + 1
+                if not entries:
+                    out.write(data[:header_end])
+                    offset = header_end
+                out.write(data[header_end:])
+                entries.append({'lemma': lemma, 'first_row': rows, 'rows': len(part),
+                                'byte_offset': offset, 'bytes': len(data) - header_end})
+                rows += len(part)
+                offset += len(data) - header_end
+
+            # skip lemmas whose rows did not change since the last run
+            digest = hash_frame(part)
+            if manifest is not None and manifest.is_current(lemma, file_name, digest):
+                continue
+            os.makedirs(os.path.join(path, lemma), exist_ok=True)
+            with atomic_writer(os.path.join(path, lemma, file_name)) as f:
+                f.write(data)
+            if manifest is not None:
+                manifest.record(lemma, file_name, digest)
+            written.append(lemma)
+
+    if concat and index:
+        write_index(entries, index_path(path, file_name))
+
+    return written
@@ -0,0 +1,101 @@
+import re
+
+import numpy as np
+
+# Numbers of up to 9 digits always fit into int32
+MAX_DIGITS = 9
+
+# A span column value: one or more 'start:end' pairs separated by commas, e.g. '38:46' or '3:8,12:20', with
+# numbers of ASCII digits that decode_spans() can parse
+NUMBER = f'[0-9]{{1,{MAX_DIGITS}}}'
+SPAN_PATTERN = re.compile(f'{NUMBER}:{NUMBER}(,{NUMBER}:{NUMBER})*')
+
+COMMA = ord(',')
+COLON = ord(':')
+
+def _first_malformed(values):
+    for row, value in enumerate(values):
+        if value and not SPAN_PATTERN.fullmatch(value):
+            return row, value
+    return None, None
+
+'''
+Parses a whole span column (e.g. indices_target_token) at once. The values are joined into one byte array and the
+numbers are parsed with numpy, so there is no Python work per span. Rows with several spans are supported through
+the row offsets: the spans of row i are starts[offsets[i]:offsets[i + 1]] and ends[offsets[i]:offsets[i + 1]].
+Empty values are rows without spans.
+
+INPUT: (iterable), the values of the column, e.g. ['38:46', '3:8,12:20'].
+OUTPUT: (numpy.ndarray, numpy.ndarray, numpy.ndarray), the int32 start and end of every span and the int64 row
+offsets (one more than the number of rows).
+'''
+def decode_spans(values):
+    values = list(values)
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    filled = lengths > 0
+    if not filled.any():
+        empty = np.zeros(0, dtype=np.int32)
+        return empty, empty.copy(), np.zeros(len(values) + 1, dtype=np.int64)
+
+    text = ','.join(filter(None, values)) + ','
+    try:
+        data = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    except UnicodeEncodeError:
+        data = None
+
+    if data is not None:
+        is_separator = (data == COMMA) | (data == COLON)
+        separators = np.flatnonzero(is_separator)
+        number_starts = np.concatenate(([0], separators[:-1] + 1))
+        number_lengths = separators - number_starts
+        kinds = data[separators]
+    # every byte is a digit or a separator, the separators alternate between ':' and ',' and every number has digits
+    if (data is None or not (is_separator | (data - ord('0') <= 9)).all() or len(separators) % 2
+            or not (kinds[0::2] == COLON).all() or not (kinds[1::2] == COMMA).all()
+            or number_lengths.min() < 1 or number_lengths.max() > MAX_DIGITS):
+        row, value = _first_malformed(values)
+        raise ValueError(f"Malformed span '{value}' in row {row}, expected 'start:end' pairs of numbers with up to {MAX_DIGITS} digits separated by commas.")
+
+    # parse all numbers digit by digit, one numpy step per digit position
+    digits = (data - ord('0')).astype(np.int32)
+    numbers = np.zeros(len(separators), dtype=np.int32)
+    for k in range(number_lengths.max()):
+        has_digit = number_lengths > k
+        position = np.minimum(number_starts + k, len(data) - 1)
+        numbers = np.where(has_digit, numbers * 10 + digits[position], numbers)
+
+    # count the spans of every row as the colons up to the end of the row
+    colons = np.concatenate(([0], np.cumsum(data == COLON)))
+    row_ends = np.cumsum(lengths[filled] + 1)
+    counts = np.zeros(len(values), dtype=np.int64)
+    counts[filled] = np.diff(np.concatenate(([0], colons[row_ends])))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    return numbers[0::2].copy(), numbers[1::2].copy(), offsets
+
+'''
+Formats spans back to the values of a span column, the inverse of decode_spans().
+
+INPUT: (numpy.ndarray, numpy.ndarray, numpy.ndarray), the start and end of every span and the row offsets.
+OUTPUT: (list), the value of every row, e.g. ['38:46', '3:8,12:20'].
+'''
+def encode_spans(starts, ends, offsets):
+    pairs = np.char.add(np.char.add(np.asarray(starts).astype(str), ':'), np.asarray(ends).astype(str)).astype(object)
+    # separate the spans of a row with commas and end every row with a newline, including rows without spans
+    last = np.zeros(len(pairs), dtype=bool)
+    row_sizes = np.diff(offsets)
+    last[(offsets[1:] - 1)[row_sizes > 0]] = True
+    pairs[~last] += ','
+    tokens = np.insert(pairs, np.asarray(offsets[1:]), '\n')
+    return ''.join(tokens.tolist()).split('\n')[:-1]
+
+'''
+Splits decoded spans into one list of (start, end) tuples per row.
+
+INPUT: (numpy.ndarray, numpy.ndarray, numpy.ndarray), the start and end of every span and the row offsets.
+OUTPUT: (list), the spans of every row, e.g. [[(38, 46)], [(3, 8), (12, 20)]].
+'''
+def span_lists(starts, ends, offsets):
+    pairs = list(zip(starts.tolist(), ends.tolist()))
+    bounds = offsets.tolist()
+    return list(map(pairs.__getitem__, map(slice, bounds[:-1], bounds[1:])))
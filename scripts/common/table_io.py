@@ -0,0 +1,340 @@
+import csv
+import io
+import os
+import shutil
+
+from catalog import catalog_lemmas
+from compressed import SUFFIXES, atomic_writer, existing_path, exists, open_binary, open_text, staged_writers
+from context_store import REF_COLUMN, find_store, open_store
+
+# Parquet support is optional, without pyarrow all tables are read from the .tsv files
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# The tables that can be stored in the binary format next to their .tsv file
+TABLE_FILES = ['uses.tsv', 'instances.tsv', 'judgments.tsv', 'senses.tsv']
+
+# Columns with few distinct values, stored dictionary-encoded
+DICTIONARY_COLUMNS = ['dataID', 'instanceID', 'senseID', 'lemma', 'annotator', 'label_set', 'non_label']
+
+# Keys of the Parquet metadata recording the size and modification time of the .tsv file it was made from, its
+# line terminator and whether its fields are quoted, so that the .tsv file can be restored byte for byte
+SOURCE_KEY = b'tsv_source'
+LINE_TERMINATOR_KEY = b'tsv_lineterminator'
+QUOTED_KEY = b'tsv_quoted'
+
+'''
+Returns the path of the Parquet copy of a .tsv file, e.g. data/uses.parquet for data/uses.tsv.
+
+INPUT: (str), the path of the .tsv file.
+OUTPUT: (str), the path of the Parquet file.
+'''
+def parquet_path(path):
+    return os.path.splitext(path)[0] + '.parquet'
+
+def _source_stamp(path):
+    st = os.stat(existing_path(path))
+    return f'{st.st_size}:{st.st_mtime_ns}'.encode('ascii')
+
+'''
+Checks whether a .tsv file has an up-to-date Parquet copy that can be read instead. The .tsv file is the
+canonical version (plain or compressed): a Parquet file is only used if it was made from the .tsv file as it is
+on disk now.
+
+INPUT: (str), the path of the .tsv file.
+OUTPUT: (bool), whether the Parquet copy can be used.
+'''
+def has_parquet(path):
+    if pq is None or not os.path.exists(parquet_path(path)) or not exists(path):
+        return False
+    metadata = pq.read_schema(parquet_path(path)).metadata or {}
+    return metadata.get(SOURCE_KEY) == _source_stamp(path)
+
+def _line_terminator(path):
+    with open_binary(path) as f:
+        return b'\r\n' if f.readline().endswith(b'\r\n') else b'\n'
+
+def _quoted_lines(f, quoted):
+    # passes the lines on to the csv reader and records in quoted[0] whether a field of the file starts quoted
+    for line in f:
+        if not quoted[0] and (line.startswith('"') or '\t"' in line):
+            quoted[0] = True
+        yield line
+
+'''
+Reads the columns of a .tsv file. The tables are read with minimal quoting like csv.DictReader, as the DWUG
+converters write them: a field in double quotes may contain tabs, line breaks and doubled quotes. Whether any
+field of the file is quoted is returned as well, so that the file can be written back with the same quoting.
+
+INPUT: (str), the path of the .tsv file.
+OUTPUT: (list, list, bool), the header, the values of every column and whether the file has quoted fields.
+'''
+def _read_tsv_columns(path):
+    quoted = [False]
+    with open_text(path) as f:
+        reader = csv.reader(_quoted_lines(f, quoted), delimiter='\t')
+        header = next(reader, [])
+        columns = [[] for _ in header]
+        for row in reader:
+            if len(row) != len(header):
+                raise ValueError(f"Row {reader.line_num} of '{path}' has {len(row)} fields, expected {len(header)}.")
+            for column, value in zip(columns, row):
+                column.append(value)
+    return header, columns, quoted[0]
+
+def _needs_quotes(value):
+    # csv.DictWriter quotes every field with a quote, tab or line break
+    return any(c in value for c in '"\t\r\n')
+
+def _write_rows(out, header, rows, line_terminator, quoted):
+    # files without quoted fields are written without quoting, so quotes inside a field stay as they are
+    f = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    if quoted:
+        writer = csv.writer(f, delimiter='\t', lineterminator=line_terminator)
+    else:
+        writer = csv.writer(f, delimiter='\t', quoting=csv.QUOTE_NONE, quotechar=None, lineterminator=line_terminator)
+    writer.writerow(header)
+    writer.writerows(rows)
+    f.flush()
+    f.detach()
+
+'''
+Writes the Parquet copy of a .tsv file. All values are stored as the strings of the .tsv file, so the copy is
+lossless, and the ID and lemma columns are dictionary-encoded.
+
+INPUT: (str), the path of the .tsv file.
+OUTPUT: (str), the path of the Parquet file.
+'''
+def write_parquet(path):
+    if pa is None:
+        raise ImportError('Writing Parquet files requires pyarrow (pip install pyarrow).')
+    header, columns, quoted = _read_tsv_columns(path)
+    arrays = []
+    for name, values in zip(header, columns):
+        array = pa.array(values, type=pa.string())
+        arrays.append(array.dictionary_encode() if name in DICTIONARY_COLUMNS else array)
+    table = pa.Table.from_arrays(arrays, names=header)
+    table = table.replace_schema_metadata({SOURCE_KEY: _source_stamp(path),
+                                           LINE_TERMINATOR_KEY: _line_terminator(path),
+                                           QUOTED_KEY: b'1' if quoted else b'0'})
+
+    out_path = parquet_path(path)
+    pq.write_table(table, out_path + '.tmp')
+    os.replace(out_path + '.tmp', out_path)
+    return out_path
+
+'''
+Restores a .tsv file from its Parquet copy, e.g. after only the Parquet files were transferred. The Parquet
+copy is stamped with the new .tsv file afterwards.
+
+INPUT: (str), the path of the .tsv file.
+OUTPUT: (str), the path of the .tsv file.
+'''
+def write_tsv(path):
+    if pq is None:
+        raise ImportError('Reading Parquet files requires pyarrow (pip install pyarrow).')
+    metadata = pq.read_schema(parquet_path(path)).metadata or {}
+    line_terminator = metadata.get(LINE_TERMINATOR_KEY, b'\n').decode('ascii')
+    table = _read_parquet(path)
+    columns = [column.to_pylist() for column in table.columns]
+    # copies without the quoting of their file are written quoted where needed, which reads back the same
+    quoted = metadata.get(QUOTED_KEY, b'1') == b'1' or any(_needs_quotes(value) for column in columns for value in column)
+    with atomic_writer(path) as out:
+        _write_rows(out, table.column_names, zip(*columns), line_terminator, quoted)
+    write_parquet(path)
+    return path
+
+def _read_parquet(path, columns=None):
+    table = pq.read_table(parquet_path(path), columns=columns)
+    # decode the dictionary-encoded columns to plain strings
+    return table.cast(pa.schema([pa.field(field.name, pa.string()) for field in table.schema]))
+
+def _header(path):
+    if has_parquet(path):
+        return pq.read_schema(parquet_path(path)).names
+    with open_text(path) as f:
+        return next(csv.reader(f, delimiter='\t'), [])
+
+'''
+Reads a table as a pandas dataframe of strings, from its Parquet copy if it is up to date and from the .tsv
+file otherwise. Empty fields are read as empty strings. Contexts that the table references in a context store
+(a context_ref column) are resolved into a context column.
+
+INPUT: (str, list), the path of the .tsv file and optionally the columns to read.
+OUTPUT: (pandas.DataFrame), the table.
+'''
+def read_table(path, columns=None):
+    if columns is not None and 'context' in columns and REF_COLUMN in _header(path):
+        columns = [REF_COLUMN if column == 'context' else column for column in columns]
+    import pandas as pd
+    if has_parquet(path):
+        df = _read_parquet(path, columns).to_pandas()
+    else:
+        with open_text(path) as f:
+            df = pd.read_csv(f, sep='\t', dtype=str, keep_default_na=False, usecols=columns)
+    if REF_COLUMN in df.columns:
+        position = df.columns.get_loc(REF_COLUMN)
+        refs = df.pop(REF_COLUMN)
+        # keep the string dtype of the column read from the file
+        df.insert(position, 'context', pd.Series(find_store(path).resolve(refs.tolist()), index=refs.index, dtype=refs.dtype))
+    return df
+
+'''
+Reads the rows of a table as dictionaries of strings, like csv.DictReader, from its Parquet copy if it is up to
+date and from the .tsv file otherwise. Contexts referenced in a context store are resolved like in read_table().
+
+INPUT: (str), the path of the .tsv file.
+OUTPUT: (iterator), one dictionary per row.
+'''
+def read_records(path):
+    if has_parquet(path):
+        rows = _read_parquet(path).to_pylist()
+        yield from _resolve_records(path, rows)
+        return
+    with open_text(path) as f:
+        yield from _resolve_records(path, csv.DictReader(f, delimiter='\t'))
+
+def _resolve_records(path, rows, batch_size=10000):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    if REF_COLUMN not in first:
+        yield first
+        yield from rows
+        return
+    # resolve the contexts of a batch of rows in one lookup
+    store = find_store(path)
+    batch = [first]
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield from _with_contexts(batch, store)
+            batch = []
+    yield from _with_contexts(batch, store)
+
+def _with_contexts(rows, store):
+    contexts = store.resolve([row[REF_COLUMN] for row in rows])
+    for row, context in zip(rows, contexts):
+        yield {('context' if key == REF_COLUMN else key): (context if key == REF_COLUMN else value)
+               for key, value in row.items()}
+
+'''
+Lists the tables of a data directory: the combined files in the directory and the files of every lemma folder
+of its catalog.
+
+INPUT: (str, list), the data directory and the names of the tables.
+OUTPUT: (list), the paths of the .tsv files that exist or have a Parquet copy.
+'''
+def tree_tables(path, file_names=TABLE_FILES):
+    dirs = [path] + [os.path.join(path, lemma) for lemma in catalog_lemmas(path)]
+    paths = [os.path.join(d, name) for d in dirs for name in file_names]
+    return [p for p in paths if exists(p) or os.path.exists(parquet_path(p))]
+
+'''
+Writes the Parquet copies of the tables of a data directory whose copies are missing or out of date.
+
+INPUT: (str, list, bool), the data directory, the names of the tables and whether to rewrite all copies.
+OUTPUT: (list), the paths of the written Parquet files.
+'''
+def convert_tree(path, file_names=TABLE_FILES, force=False):
+    return [write_parquet(tsv) for tsv in tree_tables(path, file_names)
+            if exists(tsv) and (force or not has_parquet(tsv))]
+
+'''
+Restores the missing .tsv files of a data directory from their Parquet copies.
+
+INPUT: (str, list, bool), the data directory, the names of the tables and whether to rewrite existing .tsv files.
+OUTPUT: (list), the paths of the written .tsv files.
+'''
+def restore_tree(path, file_names=TABLE_FILES, force=False):
+    return [write_tsv(tsv) for tsv in tree_tables(path, file_names)
+            if os.path.exists(parquet_path(tsv)) and (force or not exists(tsv))]
+
+def _replace_column(path, column, new_column, values_of, writer, out_path=None):
+    line_terminator = _line_terminator(path).decode('ascii')
+    quoted = [False]
+    with open_text(path) as f:
+        reader = csv.reader(_quoted_lines(f, quoted), delimiter='\t')
+        header = next(reader)
+        rows = list(reader)
+    position = header.index(column)
+    values = values_of([row[position] for row in rows])
+    header[position] = new_column
+    for row, value in zip(rows, values):
+        row[position] = value
+
+    # keep the compression of the file, and quote the file if a new value needs it (e.g. an inlined context)
+    compression = existing_path(path)[len(path) + 1:]
+    with writer(out_path or path, compression) as out:
+        _write_rows(out, header, rows, line_terminator, quoted[0] or any(_needs_quotes(value) for value in values))
+
+def _replace_tree_column(paths, column, new_column, values_of):
+    # all files are rewritten before any of them is replaced, so a failure leaves the directory as it was
+    refresh_parquet = [path for path in paths if has_parquet(path)]
+    with staged_writers() as writer:
+        for path in paths:
+            _replace_column(path, column, new_column, values_of(path), writer)
+    for path in refresh_parquet:
+        write_parquet(path)
+    return paths
+
+'''
+Moves the contexts of the uses.tsv files of a data directory into a context store: every context is stored once in
+the store and the context column of the files is replaced by a context_ref column with its hash. Several data
+directories (e.g. the lexsub, wsbest and wssim trees) can share one store, which keeps every context only once.
+The tools resolve the references when they read the files. The files are only replaced once all of them are
+rewritten, so a failure leaves the data directory as it was.
+
+INPUT: (str, str), the data directory and the directory of the store.
+OUTPUT: (list), the paths of the rewritten .tsv files.
+'''
+def externalize_tree(path, store_path):
+    store = open_store(store_path)
+    paths = [tsv for tsv in tree_tables(path, ['uses.tsv']) if exists(tsv) and 'context' in _header(tsv)]
+    return _replace_tree_column(paths, 'context', REF_COLUMN, lambda tsv: store.add)
+
+'''
+Writes the contexts referenced by the uses.tsv files of a data directory back into the files, the inverse of
+externalize_tree(). Files with contexts that contain quotes, tabs or line breaks are written with quoted fields, as
+convert_dwug.py writes them.
+
+INPUT: (str), the data directory.
+OUTPUT: (list), the paths of the rewritten .tsv files.
+'''
+def inline_tree(path):
+    paths = [tsv for tsv in tree_tables(path, ['uses.tsv']) if exists(tsv) and REF_COLUMN in _header(tsv)]
+    return _replace_tree_column(paths, REF_COLUMN, 'context', lambda tsv: find_store(tsv).resolve)
+
+'''
+Copies a table with its compression and its Parquet copy, if that is up to date, e.g. the uses.tsv of a lemma to
+the folder of a new annotation round. Contexts that the table references in a context store are written into the
+copy, as the store may not be found from where the copy is.
+
+INPUT: (str, str), the path of the .tsv file and the path of the copy.
+OUTPUT: (str), the path of the copy.
+'''
+def copy_table(path, out_path):
+    source = existing_path(path)
+    if REF_COLUMN in _header(path):
+        _replace_column(path, REF_COLUMN, 'context', find_store(path).resolve, atomic_writer, out_path)
+        if has_parquet(path):
+            write_parquet(out_path)
+        return out_path
+
+    # copy2 keeps the modification time, so the Parquet copy stays stamped with the copied file
+    target = out_path + source[len(path):]
+    shutil.copy2(source, target + '.tmp')
+    os.replace(target + '.tmp', target)
+    for suffix in SUFFIXES:
+        if out_path + suffix != target and os.path.exists(out_path + suffix):
+            os.remove(out_path + suffix)
+    if has_parquet(path):
+        shutil.copy2(parquet_path(path), parquet_path(out_path) + '.tmp')
+        os.replace(parquet_path(out_path) + '.tmp', parquet_path(out_path))
+    elif os.path.exists(parquet_path(out_path)):
+        os.remove(parquet_path(out_path))
+    return out_path
@@ -0,0 +1,143 @@
+import hashlib
+import http.server
+import os
+import tempfile
+import threading
+import unittest
+
+import download
+from download import fetch, known_checksum
+
+'''
+A local stand-in for the archive servers: serves one file with a strong ETag and answers range requests with
+206, unless an If-Range header names another version of the file.
+'''
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    content = b''
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        data = type(self).content
+        ranged = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        type(self).requests.append((ranged, if_range))
+        if ranged and (if_range is None or if_range == type(self).etag):
+            start = int(ranged.split('=')[1].split('-')[0])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+            body = data[start:]
+        else:
+            self.send_response(200)
+            body = data
+        self.send_header('ETag', type(self).etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.HTTPServer(('127.0.0.1', 0), ArchiveHandler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/archive.zip'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cache = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache.cleanup)
+        ArchiveHandler.content = os.urandom(100000)
+        ArchiveHandler.etag = '"v1"'
+        ArchiveHandler.requests = []
+        # pin the checksums of the test downloads in the temporary directory
+        checksums_path = download.CHECKSUMS_PATH
+        download.CHECKSUMS_PATH = os.path.join(self.cache.name, 'checksums.tsv')
+        self.addCleanup(setattr, download, 'CHECKSUMS_PATH', checksums_path)
+        key = hashlib.sha256(self.url.encode('utf-8')).hexdigest()
+        self.part_path = os.path.join(self.cache.name, 'partial', key + '.part')
+
+    def interrupted(self, size, validator):
+        # leaves the partial file of a download that stopped after size bytes
+        os.makedirs(os.path.dirname(self.part_path), exist_ok=True)
+        with open(self.part_path, 'wb') as f:
+            f.write(ArchiveHandler.content[:size])
+        with open(self.part_path + '.validator', 'w') as f:
+            f.write(validator)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_download_is_cached(self):
+        checksum = 'sha256:' + hashlib.sha256(ArchiveHandler.content).hexdigest()
+        path = fetch(self.url, checksum, cache_dir=self.cache.name)
+        self.assertEqual(self.read(path), ArchiveHandler.content)
+        self.assertEqual(fetch(self.url, checksum, cache_dir=self.cache.name), path)
+        self.assertEqual(len(ArchiveHandler.requests), 1)
+        self.assertFalse(os.path.exists(self.part_path + '.validator'))
+
+    def test_resume_same_version(self):
+        self.interrupted(30000, '"v1"')
+        path = fetch(self.url, cache_dir=self.cache.name)
+        self.assertEqual(ArchiveHandler.requests, [('bytes=30000-', '"v1"')])
+        self.assertEqual(self.read(path), ArchiveHandler.content)
+
+    def test_restart_changed_version(self):
+        self.interrupted(30000, '"v1"')
+        ArchiveHandler.content = os.urandom(80000)
+        ArchiveHandler.etag = '"v2"'
+        path = fetch(self.url, cache_dir=self.cache.name)
+        self.assertEqual(ArchiveHandler.requests, [('bytes=30000-', '"v1"')])
+        self.assertEqual(self.read(path), ArchiveHandler.content)
+
+    def test_restart_without_validator(self):
+        self.interrupted(30000, '')
+        path = fetch(self.url, cache_dir=self.cache.name)
+        self.assertEqual(ArchiveHandler.requests, [(None, None)])
+        self.assertEqual(self.read(path), ArchiveHandler.content)
+
+    def test_complete_partial_file(self):
+        self.interrupted(len(ArchiveHandler.content), '"v1"')
+        path = fetch(self.url, cache_dir=self.cache.name)
+        self.assertEqual(len(ArchiveHandler.requests), 1)
+        self.assertEqual(self.read(path), ArchiveHandler.content)
+        self.assertFalse(os.path.exists(self.part_path + '.validator'))
+
+    def test_pin_first_download(self):
+        fetch(self.url, cache_dir=self.cache.name)
+        digest = hashlib.sha256(ArchiveHandler.content).hexdigest()
+        self.assertEqual(known_checksum(self.url), 'sha256:' + digest)
+        # a changed archive does not match the pinned checksum
+        ArchiveHandler.content = os.urandom(1000)
+        with self.assertRaises(ValueError):
+            fetch(self.url, cache_dir=os.path.join(self.cache.name, 'other'))
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(ValueError):
+            fetch(self.url, 'sha256:' + '0' * 64, cache_dir=self.cache.name)
+        self.assertFalse(os.path.exists(self.part_path))
+
+    def test_known_checksum(self):
+        path = os.path.join(self.cache.name, 'checksums.tsv')
+        with open(path, 'w') as f:
+            f.write(f'url\tchecksum\n{self.url}\tsha256:{"0" * 64}\n')
+        self.assertEqual(known_checksum(self.url, path), 'sha256:' + '0' * 64)
+        self.assertIsNone(known_checksum(self.url + '?download=1', path))
+
+
+if __name__ == '__main__':
+    unittest.main()
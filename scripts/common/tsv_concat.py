@@ -0,0 +1,136 @@
+import csv
+import os
+
+from catalog import catalog_lemmas
+from compressed import atomic_writer, open_binary, open_text
+
+# Size of the blocks copied from the lemma files to the combined file
+CHUNK_SIZE = 1 << 20
+
+INDEX_COLUMNS = ['lemma', 'first_row', 'rows', 'byte_offset', 'bytes']
+
+'''
+Copies the body of one .tsv file to an open output file in large chunks without parsing it.
+
+INPUT: (file, file, int), an input file positioned after its header, the output file and the chunk size.
+OUTPUT: (int, int, bool), the number of lines and bytes copied and whether the body contains a double quote.
+'''
+def _copy_body(f, out, chunk_size):
+    rows = 0
+    size = 0
+    last = b'\n'
+    quoted = False
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        out.write(chunk)
+        rows += chunk.count(b'\n')
+        size += len(chunk)
+        last = chunk[-1:]
+        quoted = quoted or b'"' in chunk
+    # Terminate the last row if the file does not end with a newline
+    if last != b'\n':
+        out.write(b'\n')
+        rows += 1
+        size += 1
+    return rows, size, quoted
+
+'''
+Counts the rows of a .tsv file with a csv reader, so that quoted fields with line breaks (as csv.DictWriter
+writes them) count as one row.
+
+INPUT: (str), the path of the .tsv file.
+OUTPUT: (int), the number of rows without the header.
+'''
+def _count_rows(path):
+    with open_text(path) as f:
+        reader = csv.reader(f, delimiter='\t')
+        next(reader, None)
+        return sum(1 for _ in reader)
+
+'''
+Returns the path of the row-offset index of a combined file, e.g. data/uses.index.tsv for data/uses.tsv.
+
+INPUT: (str, str), a path to a data directory and the name of the combined file.
+OUTPUT: (str), the path of the index file.
+'''
+def index_path(path, file_name):
+    return os.path.join(path, os.path.splitext(file_name)[0] + '.index.tsv')
+
+'''
+Writes the row-offset index of a combined file.
+
+INPUT: (list, str), the index entries and the path of the index file.
+OUTPUT: (None)
+'''
+def write_index(index, path):
+    with open(path, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=INDEX_COLUMNS, delimiter='\t', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(index)
+
+'''
+Concatenates .tsv files with identical headers into a single file. The header is written once and
+the file bodies are copied byte for byte, so values are never re-typed and memory use does not depend
+on the size of the files. Rows are counted as lines, unless a file contains double quotes: its rows are
+counted with a csv reader, as a quoted field may contain line breaks. Compressed input files (.tsv.gz, .tsv.zst) are read transparently and the combined file
+is compressed as set by ANNOTATION_TSV_COMPRESSION; the byte ranges refer to the uncompressed file.
+
+INPUT: (list, str, list, str), paths to the .tsv files, the path of the combined file, the lemma name
+of each file and optionally a path to write a row-offset index to.
+OUTPUT: (list), one index entry per input file with the lemma, its first row and number of rows in the
+combined file and the byte range of its rows.
+'''
+def concat_tsv(paths, out_path, lemmas, index_path=None, chunk_size=CHUNK_SIZE):
+    header = None
+    index = []
+    rows = 0
+    # byte offsets are counted in the uncompressed file, the position of a compressed writer differs
+    offset = 0
+
+    with atomic_writer(out_path) as out:
+        for lemma, path in zip(lemmas, paths):
+            with open_binary(path) as f:
+                file_header = f.readline()
+                if header is None:
+                    header = file_header if file_header.endswith(b'\n') else file_header + b'\n'
+                    out.write(header)
+                    offset = len(header)
+                elif file_header.rstrip(b'\r\n') != header.rstrip(b'\r\n'):
+                    raise ValueError(f"Header of '{path}' does not match the header of '{paths[0]}'.")
+
+                copied, size, quoted = _copy_body(f, out, chunk_size)
+                if quoted:
+                    # a quoted field may span lines, count the rows of such files with a csv reader
+                    copied = _count_rows(path)
+                index.append({'lemma': lemma, 'first_row': rows, 'rows': copied,
+                              'byte_offset': offset, 'bytes': size})
+                rows += copied
+                offset += size
+
+    if index_path is not None:
+        write_index(index, index_path)
+
+    return index
+
+'''
+Concatenates the per-lemma files of a data directory into combined files in the data directory itself,
+e.g. data/*/uses.tsv into data/uses.tsv.
+
+INPUT: (str, list, list, bool), a path to a data directory, the names of the files to concatenate,
+optionally the lemma folders to include (the lemmas of the catalog by default) and whether to write a
+row-offset index (e.g. data/uses.index.tsv) next to each combined file.
+OUTPUT: (dict), the index entries of each combined file.
+'''
+def concat_tree(path, file_names, lemmas=None, index=False):
+    if lemmas is None:
+        lemmas = catalog_lemmas(path)
+
+    indices = {}
+    for file_name in file_names:
+        paths = [os.path.join(path, lemma, file_name) for lemma in lemmas]
+        indices[file_name] = concat_tsv(paths, os.path.join(path, file_name), lemmas,
+                                        index_path(path, file_name) if index else None)
+
+    return indices
@@ -0,0 +1,88 @@
+import csv
+import os
+import threading
+
+from download import DEFAULT_CACHE_DIR
+
+# Version of the NLTK 'wordnet' corpus the sense keys are resolved with
+WORDNET_VERSION = '3.0'
+
+# NLTK loads WordNet lazily, which is not thread-safe
+_lock = threading.Lock()
+
+'''
+Returns the path of the definition cache of a WordNet version.
+
+INPUT: (str, str), the WordNet version and the cache directory.
+OUTPUT: (str), the path of the cache file.
+'''
+def cache_path(version=WORDNET_VERSION, cache_dir=None):
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, 'wordnet', f'definitions-{version}.tsv')
+
+'''
+Reads the definition cache of a WordNet version.
+
+INPUT: (str), the path of the cache file.
+OUTPUT: (dict), the definition of each cached sense key.
+'''
+def load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', newline='') as f:
+        return {row['sense_key']: row['definition'] for row in csv.DictReader(f, delimiter='\t')}
+
+'''
+Writes the definition cache of a WordNet version. The cache is written to a temporary file first and then
+replaced, so other processes never read a partly written cache.
+
+INPUT: (str, dict), the path of the cache file and the definition of each sense key.
+OUTPUT: (None)
+'''
+def save_cache(path, definitions):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(['sense_key', 'definition'])
+        writer.writerows(sorted(definitions.items()))
+    os.replace(tmp_path, path)
+
+'''
+Loads the NLTK WordNet corpus, downloading it only if it is not installed.
+
+INPUT: (str), the expected WordNet version.
+OUTPUT: (nltk.corpus.reader.WordNetCorpusReader), the loaded corpus.
+'''
+def load_wordnet(version=WORDNET_VERSION):
+    import nltk
+    from nltk.corpus import wordnet as wn
+    try:
+        wn.ensure_loaded()
+    except LookupError:
+        nltk.download('wordnet')
+        nltk.download('omw-1.4')
+        wn.ensure_loaded()
+    if wn.get_version() != version:
+        raise ValueError(f'Expected WordNet {version}, but NLTK provides WordNet {wn.get_version()}.')
+    return wn
+
+'''
+Resolves WordNet sense keys (e.g. 'account%1:10:00::') to the definitions of their synsets. Every key is
+resolved only once and the definitions are kept in a cache file per WordNet version, so NLTK is not
+imported at all if every key was resolved in an earlier run.
+
+INPUT: (iterable, str, str), the sense keys, the WordNet version and the cache directory.
+OUTPUT: (dict), the definition of each sense key.
+'''
+def resolve_definitions(keys, version=WORDNET_VERSION, cache_dir=None):
+    keys = list(dict.fromkeys(keys))
+    path = cache_path(version, cache_dir)
+    with _lock:
+        definitions = load_cache(path)
+        missing = [key for key in keys if key not in definitions]
+        if missing:
+            wn = load_wordnet(version)
+            for key in missing:
+                definitions[key] = wn.lemma_from_key(key).synset().definition()
+            save_cache(path, definitions)
+    return {key: definitions[key] for key in keys}
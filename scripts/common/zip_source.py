@@ -0,0 +1,83 @@
+import io
+import os
+import zipfile
+from functools import lru_cache
+
+from manifest import hash_file, hash_strings
+
+'''
+Opens a zip archive once per process. Worker processes get their own handle, as a file offset
+inherited from the parent process would be shared between them.
+
+INPUT: (str, int), a path to a zip archive and the id of the calling process.
+OUTPUT: (zipfile.ZipFile), the opened archive.
+'''
+@lru_cache(maxsize=8)
+def _open_archive(path, pid):
+    return zipfile.ZipFile(path)
+
+def open_archive(path):
+    return _open_archive(os.path.abspath(path), os.getpid())
+
+'''
+Lists the lemma folders below a folder of a zip archive, e.g. the lemmas of 'dwug_en/data/'.
+Only folders containing a uses.csv file are returned.
+
+INPUT: (str, str), a path to a zip archive and the folder inside the archive.
+OUTPUT: (dict), the member folder of each lemma (e.g. {'afternoon_nn': 'dwug_en/data/afternoon_nn/'}).
+'''
+def lemma_members(archive, data_dir):
+    data_dir = data_dir.rstrip('/') + '/'
+    lemmas = {}
+    for name in open_archive(archive).namelist():
+        if not name.startswith(data_dir):
+            continue
+        parts = name[len(data_dir):].split('/')
+        if len(parts) == 2 and parts[1] == 'uses.csv':
+            lemmas[parts[0]] = data_dir + parts[0] + '/'
+    return dict(sorted(lemmas.items()))
+
+'''
+Opens a file of a lemma folder as a text stream. The folder is either a directory on disk or a
+(zip archive, member folder) pair, in which case the file is decompressed while it is read and
+never written to disk.
+
+INPUT: (str or tuple, str), the lemma folder and the file name (e.g. 'uses.csv').
+OUTPUT: (io.TextIOBase), the opened file.
+'''
+def open_source(source, file_name):
+    if isinstance(source, str):
+        return open(os.path.join(source, file_name), 'r', newline='')
+    archive, folder = source
+    return io.TextIOWrapper(open_archive(archive).open(folder + file_name), encoding='utf-8', newline='')
+
+'''
+Computes a digest of the source files of a lemma folder without reading archive members: the CRC-32
+and size stored in the zip directory are used for archive members, files on disk are hashed.
+
+INPUT: (str or tuple, list), the lemma folder and the names of its source files.
+OUTPUT: (str), the sha256 hex digest.
+'''
+def source_digest(source, file_names):
+    parts = []
+    for file_name in file_names:
+        if isinstance(source, str):
+            parts.append(file_name + ':' + hash_file(os.path.join(source, file_name)))
+        else:
+            archive, folder = source
+            info = open_archive(archive).getinfo(folder + file_name)
+            parts.append(f'{file_name}:{info.CRC:08x}:{info.file_size}')
+    return hash_strings(parts)
+
+'''
+Returns the uncompressed size of the source files of a lemma folder, read from the zip directory for archive
+members, e.g. to convert the largest lemmas first.
+
+INPUT: (str or tuple, list), the lemma folder and the names of its source files.
+OUTPUT: (int), the size in bytes.
+'''
+def source_size(source, file_names):
+    if isinstance(source, str):
+        return sum(os.path.getsize(os.path.join(source, file_name)) for file_name in file_names)
+    archive, folder = source
+    return sum(open_archive(archive).getinfo(folder + file_name).file_size for file_name in file_names)
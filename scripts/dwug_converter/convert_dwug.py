@@ -1,23 +1,36 @@
 import csv
 import os
+import sys
+import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import argparse
 import requests
-import zipfile
-from io import BytesIO
-import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog import write_catalog
+from download import fetch
+from manifest import Manifest
+from zip_source import lemma_members, open_source, source_digest, source_size
+from compressed import open_text
+from table_io import convert_tree
+from tsv_concat import concat_tree
+
+# Increase when a change to the converter changes its output, so that all lemmas are regenerated
+CONVERTER_VERSION = '1'
+SOURCE_FILES = ['uses.csv', 'judgments.csv']
+OUTPUT_FILES = ['uses.tsv', 'instances.tsv', 'judgments.tsv']
 
 '''
 Extracts data from DWUG_EN uses.csv file and stores them in python dictionary corresponding to our schema.
 
-INPUT: (str), a path to a directory containing a uses.csv file in the DWUG format
+INPUT: (str or tuple), a path to a directory containing a uses.csv file in the DWUG format, or a (zip archive, member folder) pair
 OUTPUT: (dict), a python dictionary containing data for a uses.tsv file per our schema.
 
 '''
 def transform_uses(path):
-    fn = path
     uses = {}
-    with open(os.path.join(fn, 'uses.csv'), 'r') as f:
+    with open_source(path, 'uses.csv') as f:
         reader = csv.DictReader(f, delimiter='\t',quoting=csv.QUOTE_NONE,strict=True)
         for row in reader:
             uses[row['identifier']] = {
@@ -34,17 +47,16 @@ def transform_uses(path):
 '''
 Extracts data from DWUG_EN judgments.csv file and stores them in python dictionary corresponding to our instances.tsv schema.
 
-INPUT: (str), a path to a directory containing a judgments.csv file in the DWUG format
+INPUT: (str or tuple), a path to a directory containing a judgments.csv file in the DWUG format, or a (zip archive, member folder) pair
 OUTPUT: (dict), a python dictionary containing data for a instances.tsv file per our schema.
 
 '''
 def transform_instances(path, lem):
-    fn = path
     instances = {}
     inst_count = 0
     label_set = '1,2,3,4'
     non_label = '-'
-    with open(os.path.join(fn, 'judgments.csv'), 'r') as f:
+    with open_source(path, 'judgments.csv') as f:
         reader = csv.DictReader(f, delimiter='\t',quoting=csv.QUOTE_NONE,strict=True)
         for row in reader:
             data_ids = row['identifier1'] + ',' + row['identifier2']
@@ -71,15 +83,14 @@ def transform_instances(path, lem):
 
 '''
 Extracts data from DWUG_EN judgments.csv file and stores them in python dictionary corresponding to our judgments.tsv schema.
-INPUT: (str), (id_dict): a path to a directory containing a judgments.csv file in the DWUG format and a dictionary matching
+INPUT: (str or tuple), (id_dict): a path to a directory containing a judgments.csv file in the DWUG format (or a (zip archive, member folder) pair) and a dictionary matching
 instanceIds to dataIDs.
 OUTPUT: (dict), a python dictionary containing data for a judgments.tsv file per our schema.
 '''
 def transform_judgments(path, id_dict):
-    fn = path
     judgment_count = 0
     judgments = {}
-    with open(os.path.join(fn, 'judgments.csv'), 'r') as f:
+    with open_source(path, 'judgments.csv') as f:
         reader = csv.DictReader(f, delimiter='\t',quoting=csv.QUOTE_NONE,strict=True)
         for row in reader:
             data_ids = row['identifier1'] + ',' + row['identifier2']
@@ -113,7 +124,7 @@ def write_uses_tsv(uses_dict, path):
     keys = ['dataID', 'context', 'indices_target_token', 'indices_target_sentence', 'lemma']
     rows = uses_dict.values()
 
-    with open(fn, 'w') as f:
+    with open_text(fn, 'w') as f:
         dict_writer = csv.DictWriter(f, fieldnames=keys, delimiter='\t')
         dict_writer.writeheader()
         dict_writer.writerows(rows)
@@ -131,7 +142,7 @@ def write_instances_tsv(instances_dict, path):
     keys = ['instanceID', 'dataIDs', 'label_set', 'non_label']
     rows = instances_dict.values()
 
-    with open(fn, 'w') as f:
+    with open_text(fn, 'w') as f:
         dict_writer = csv.DictWriter(f, fieldnames=keys, delimiter='\t')
         dict_writer.writeheader()
         dict_writer.writerows(rows)
@@ -147,94 +158,276 @@ def write_judgments_tsv(judgments_dict, path):
     keys = ['instanceID', 'label', 'comment', 'annotator']
     rows = judgments_dict.values()
 
-    with open(fn, 'w') as f:
+    with open_text(fn, 'w') as f:
         dict_writer = csv.DictWriter(f, fieldnames=keys, delimiter='\t')
         dict_writer.writeheader()
         dict_writer.writerows(rows)
 
 '''
-Accepts a path to a directory containing a uses.csv and judgments.csv file in the DWUG_EN format. Calls write_uses_tsv()
-and write_instances_tsv() functions to write uses.tsv and instances.tsv files.
+Accepts a DWUG lemma folder containing a uses.csv and judgments.csv file in the DWUG_EN format. Calls write_uses_tsv(),
+write_instances_tsv() and write_judgments_tsv() functions to write uses.tsv, instances.tsv and judgments.tsv files.
 
-INPUT: (str), a path to a directory containing uses.csv and judments.csv files in DWUG_EN format.
-OUTPUT: (None), writes uses.tsv and instances.tsv files per our schema.
+INPUT: (str or tuple, str), a path to a directory containing uses.csv and judments.csv files in DWUG_EN format, or a
+(zip archive, member folder) pair, and the directory to write the .tsv files to (defaults to the lemma directory).
+OUTPUT: (None), writes uses.tsv, instances.tsv and judgments.tsv files per our schema.
 '''
 
-def transform_dwug(path):
+def transform_dwug(path, out_path=None):
+    if out_path is None:
+        out_path = path
     uses, lem = transform_uses(path)
     instances, id_dict = transform_instances(path, lem)
     judgments = transform_judgments(path, id_dict)
-    write_uses_tsv(uses, path)
-    write_instances_tsv(instances, path)
-    write_judgments_tsv(judgments, path)
-
-def concat_dwugs(path):
-    uses = pd.DataFrame()
-    instances = pd.DataFrame()
-    judgments = pd.DataFrame()
-
-    for dir in os.listdir(path):
-        f = os.path.join(path, dir)
-
-        # Get paths to datafiles
-        use_path = os.path.join(f, 'uses.tsv')
-        inst_path = os.path.join(f, 'instances.tsv')
-        judge_path = os.path.join(f, 'judgments.tsv')
-
-        # Create dataframes from paths
-        use_frame = pd.read_csv(use_path, delimiter='\t')
-        inst_frame = pd.read_csv(inst_path, delimiter='\t')
-        judge_frame = pd.read_csv(judge_path, delimiter='\t')
-
-        # Concat frames
-        uses = pd.concat([uses, use_frame])
-        instances = pd.concat([instances, inst_frame])
-        judgments = pd.concat([judgments, judge_frame])
-    
-    uses.to_csv(os.path.join(path, 'uses.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-    instances.to_csv(os.path.join(path, 'instances.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-    judgments.to_csv(os.path.join(path, 'judgments.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-
-def download_dwug(path, lang='en'):
-    urls = {'en': 'https://zenodo.org/record/5796878/files/dwug_en.zip', 
-            'de': 'https://zenodo.org/record/7295410/files/dwug_de.zip',
-            'la': 'https://zenodo.org/record/5255228/files/dwug_la.zip',
-            'sv': 'https://zenodo.org/record/5090648/files/dwug_sv.zip',
-            'es': 'https://zenodo.org/record/6433667/files/dwug_es.zip'
-            }
-    url = urls[lang]
-    req = requests.get(url)
-    zip_file = zipfile.ZipFile(BytesIO(req.content))
-    zip_file.extractall(path)
+    write_uses_tsv(uses, out_path)
+    write_instances_tsv(instances, out_path)
+    write_judgments_tsv(judgments, out_path)
+
+'''
+Concatenates the per-lemma uses.tsv, instances.tsv and judgments.tsv files of a DWUG data directory
+into combined files in the data directory.
+
+INPUT: (str, list, bool), a path to the data directory, optionally the lemma folders to include and whether
+to write a row-offset index next to each combined file.
+OUTPUT: (dict), the row-offset index entries of each combined file.
+'''
+def concat_dwugs(path, lemmas=None, index=False):
+    return concat_tree(path, ['uses.tsv', 'instances.tsv', 'judgments.tsv'], lemmas, index)
+
+DWUG_URLS = {'en': 'https://zenodo.org/record/5796878/files/dwug_en.zip',
+             'de': 'https://zenodo.org/record/7295410/files/dwug_de.zip',
+             'la': 'https://zenodo.org/record/5255228/files/dwug_la.zip',
+             'sv': 'https://zenodo.org/record/5090648/files/dwug_sv.zip',
+             'es': 'https://zenodo.org/record/6433667/files/dwug_es.zip'
+             }
+
+'''
+Downloads the DWUG archive of a language to the local download cache. The archive is not extracted,
+the converters read the csv files straight from its members.
+
+INPUT: (str, requests.Session), the language code ('en' for English) and an optional session to reuse connections.
+OUTPUT: (str), the path to the zip archive.
+'''
+def download_dwug(lang='en', session=None):
+    return fetch(DWUG_URLS[lang], session=session)
+
+'''
+Creates a requests session whose connection pool is large enough for one connection per concurrent download.
+
+INPUT: (int), the number of concurrent downloads.
+OUTPUT: (requests.Session), the session.
+'''
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+'''
+Converts a single lemma folder of a DWUG archive. Runs in a worker process when convert_dwug.py is called
+with --jobs.
+
+INPUT: (tuple, str), the (zip archive, member folder) pair of the lemma and the directory to write the .tsv files to.
+OUTPUT: (float), the number of seconds the conversion took.
+'''
+def convert_lemma(source, out_path):
+    start = time.perf_counter()
+    os.makedirs(out_path, exist_ok=True)
+    transform_dwug(source, out_path)
+    return time.perf_counter() - start
+
+'''
+Converts every lemma folder below a folder of a DWUG archive into a lemma directory below dwug_path. With jobs > 1
+the lemmas are converted in parallel worker processes, largest first. A failing lemma does not stop the others, its
+error is collected instead. Lemmas whose source files, converter version and .tsv files are unchanged since the last run
+(according to dwug_path/manifest.tsv) are not converted again. An archive without lemma folders in the data folder
+raises a ValueError before anything is written, instead of producing empty combined files.
+
+INPUT: (str, str, str, int, concurrent.futures.Executor), a path to the DWUG zip archive, the data folder inside the
+archive (e.g. 'dwug_en/data'), the output data directory, the number of worker processes and optionally an executor
+shared with other conversions, which is used instead of starting new worker processes.
+OUTPUT: (dict, dict, list), conversion times in seconds per lemma, error messages per failed lemma and the lemmas
+that were already up to date.
+'''
+def convert_lemmas(archive, data_dir, dwug_path, jobs=1, executor=None):
+    sources = {lemma: (archive, folder) for lemma, folder in lemma_members(archive, data_dir).items()}
+    if not sources:
+        raise ValueError(f"'{archive}' has no lemma folders in '{data_dir}'.")
+    os.makedirs(dwug_path, exist_ok=True)
+    manifest = Manifest(dwug_path, CONVERTER_VERSION)
+    digests = {lemma: source_digest(source, SOURCE_FILES) for lemma, source in sources.items()}
+    current = [lemma for lemma in sources if manifest.is_current(lemma, OUTPUT_FILES, digests[lemma])]
+    # hand the largest lemmas to the workers first, so that no large lemma is left for the end of the run
+    stale = sorted((lemma for lemma in sources if lemma not in current),
+                   key=lambda lemma: -source_size(sources[lemma], SOURCE_FILES))
+    stale = {lemma: sources[lemma] for lemma in stale}
+
+    if executor is None and jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            timings, errors = _convert_all(stale, dwug_path, pool)
+    else:
+        timings, errors = _convert_all(stale, dwug_path, executor)
+
+    for lemma in timings:
+        manifest.record(lemma, OUTPUT_FILES, digests[lemma])
+    manifest.save()
+
+    return timings, errors, current
+
+'''
+Converts lemma folders inline or through an executor and collects the per-lemma errors.
+
+INPUT: (dict, str, concurrent.futures.Executor), the source of each lemma, the output data directory and an optional executor.
+OUTPUT: (dict, dict), conversion times in seconds per lemma and error messages per failed lemma.
+'''
+def _convert_all(sources, dwug_path, executor=None):
+    timings = {}
+    errors = {}
+
+    if executor is None:
+        for lemma, source in sources.items():
+            try:
+                timings[lemma] = convert_lemma(source, os.path.join(dwug_path, lemma))
+            except Exception as e:
+                errors[lemma] = f'{type(e).__name__}: {e}'
+        return timings, errors
+
+    futures = {executor.submit(convert_lemma, source, os.path.join(dwug_path, lemma)): lemma for lemma, source in sources.items()}
+    for future in as_completed(futures):
+        lemma = futures[future]
+        try:
+            timings[lemma] = future.result()
+        except Exception as e:
+            errors[lemma] = f'{type(e).__name__}: {e}'
+
+    return timings, errors
+
+'''
+Downloads, converts and concatenates the DWUG data of one language into start_directory/dwug_<lang>/data.
+
+INPUT: (str, str, int, bool, requests.Session, concurrent.futures.Executor, bool), the start directory, the language
+code, the number of worker processes, whether to write row-offset indices, optionally a shared session and executor,
+and whether to write Parquet copies of the .tsv files.
+OUTPUT: (dict), the download and conversion times in seconds, the conversion time per lemma, the errors per lemma
+and the lemmas that were already up to date.
+'''
+def convert_language(path, lang, jobs=1, index=False, session=None, executor=None, parquet=False):
+    start = time.perf_counter()
+    archive = download_dwug(lang, session)
+    downloaded = time.perf_counter()
+
+    dwug_path = os.path.join(path, 'dwug_' + lang + '/data')
+    timings, errors, current = convert_lemmas(archive, 'dwug_' + lang + '/data', dwug_path, jobs, executor)
+
+    # Concatenate and catalog the files of the successfully converted and up to date lemmas
+    lemmas = sorted([*timings, *current])
+    concat_dwugs(dwug_path, lemmas, index)
+    write_catalog(dwug_path, OUTPUT_FILES, lemmas, timings)
+    if parquet:
+        convert_tree(dwug_path)
+
+    return {'download': downloaded - start, 'convert': time.perf_counter() - downloaded,
+            'timings': timings, 'errors': errors, 'current': current}
+
+'''
+Converts the DWUG data of several languages. The archives are downloaded concurrently through one pooled session,
+and each language is converted as soon as its archive is available, while the other languages are still downloading.
+All languages share one pool of worker processes. A language whose download fails does not stop the others.
+
+INPUT: (str, list, int, bool, bool), the start directory, the language codes, the number of worker processes, whether
+to write row-offset indices and whether to write Parquet copies of the .tsv files.
+OUTPUT: (dict), the result of convert_language() per language, or an error message for failed languages.
+'''
+def convert_languages(path, langs, jobs=1, index=False, parquet=False):
+    results = {}
+    with make_session(len(langs)) as session, \
+            ProcessPoolExecutor(max_workers=max(jobs, 1)) as executor, \
+            ThreadPoolExecutor(max_workers=len(langs)) as threads:
+        futures = {threads.submit(convert_language, path, lang, jobs, index, session, executor, parquet): lang for lang in langs}
+        for future in as_completed(futures):
+            lang = futures[future]
+            try:
+                results[lang] = future.result()
+            except Exception as e:
+                results[lang] = f'{type(e).__name__}: {e}'
+    return results
+
+'''
+Prints the conversion time of each lemma (slowest first) followed by any per-lemma errors.
+
+INPUT: (dict, dict, float, list), conversion times per lemma, error messages per lemma, the wall clock time and
+the lemmas that were already up to date.
+OUTPUT: (None), prints the summary.
+'''
+def print_summary(timings, errors, wall_time, current=()):
+    for lemma, seconds in sorted(timings.items(), key=lambda x: x[1], reverse=True):
+        print(f'{lemma}\t{seconds:.2f}s')
+    print(f'Converted {len(timings)} lemmas in {wall_time:.2f}s (sum of lemma times {sum(timings.values()):.2f}s)')
+    if current:
+        print(f'Skipped {len(current)} lemmas that were up to date')
+    for lemma, error in sorted(errors.items()):
+        print(f'FAILED {lemma}: {error}')
+
+'''
+Prints the download and conversion time of every language followed by any errors.
+
+INPUT: (dict, float), the results of convert_languages() and the wall clock time.
+OUTPUT: (None), prints the report.
+'''
+def print_report(results, wall_time):
+    print('language\tdownload\tconvert\tconverted\tskipped\tfailed')
+    for lang, res in sorted(results.items()):
+        if isinstance(res, str):
+            print(f'{lang}\t-\t-\t0\t0\t-')
+            continue
+        print(f"{lang}\t{res['download']:.2f}s\t{res['convert']:.2f}s\t{len(res['timings'])}\t{len(res['current'])}\t{len(res['errors'])}")
+    print(f'Total {wall_time:.2f}s')
+    for lang, res in sorted(results.items()):
+        if isinstance(res, str):
+            print(f'FAILED {lang}: {res}')
+            continue
+        for lemma, error in sorted(res['errors'].items()):
+            print(f'FAILED {lang}/{lemma}: {error}')
 
 '''
 Main function is called from the command line with two arguments: 1) A directory to download the data, and
-2) the language code ('en' for english).
+2) the language code ('en' for english), several codes separated by commas (e.g. "en,de") or "all" for all
+languages. The optional --jobs argument sets the number of worker processes used to convert the lemma folders.
 '''
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('start_directory', metavar='start_directory', type=str, help='Enter directory to download data')
-    parser.add_argument('language', metavar='language', type=str, help='Enter language code ("en" for English)')
+    parser.add_argument('language', metavar='language', type=str, help='Enter language code ("en" for English), several codes separated by commas or "all"')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of worker processes used to convert lemma folders')
+    parser.add_argument('--index', action='store_true', help='Write a per-lemma row-offset index next to the concatenated files')
+    parser.add_argument('--parquet', action='store_true', help='Also write a Parquet copy of every .tsv file (requires pyarrow)')
     args = parser.parse_args()
     path = args.start_directory
-    lang = args.language
 
-    # Download the data
-    download_dwug(path, lang)
-    dwug_path = os.path.join(path, 'dwug_' + lang + '/data')
+    if args.language == 'all':
+        langs = list(DWUG_URLS)
+    else:
+        langs = [x.strip() for x in args.language.split(',')]
+    for lang in langs:
+        if lang not in DWUG_URLS:
+            parser.error(lang + ' not a valid language code')
+
+    start = time.perf_counter()
+
+    if len(langs) == 1:
+        res = convert_language(path, langs[0], args.jobs, args.index, parquet=args.parquet)
+        print_summary(res['timings'], res['errors'], time.perf_counter() - start, res['current'])
+        if res['errors']:
+            sys.exit(1)
+        return
+
+    # Download and convert several languages concurrently
+    results = convert_languages(path, langs, args.jobs, args.index, args.parquet)
+    print_report(results, time.perf_counter() - start)
+
+    if any(isinstance(res, str) or res['errors'] for res in results.values()):
+        sys.exit(1)
 
-    for dir in os.listdir(dwug_path):
-        f = os.path.join(dwug_path, dir)
-        transform_dwug(f)
-        
-        # Cleanup
-        for file_name in os.listdir(f):
-            if file_name.endswith('.csv'):
-                os.remove(os.path.join(f, file_name))
-                
-    # Concatenate files
-    concat_dwugs(dwug_path)
-        
 if __name__ == '__main__':
     main()
@@ -3,11 +3,30 @@ import pandas as pd
 import numpy as np
 from scipy.stats import spearmanr
 import os 
+import sys
 import argparse
 from collections import defaultdict
 from csv import DictWriter
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog import catalog_lemmas
+from table_io import read_table
+
+'''
+Casts a column of strings to numbers if all of its values are numbers, as pandas.read_csv does, so that
+e.g. integer instance ids are grouped in numeric order.
+
+INPUT[pandas.Series]: A column read by read_table().
+
+OUTPUT[pandas.Series]: The numeric column, or the column itself if it contains other values.
+'''
+def infer_numeric(column):
+    try:
+        return pd.to_numeric(column)
+    except (ValueError, TypeError):
+        return column
+
 '''
 Loads and aggregates judgments data/calculates median value of judgment. Returns
 grouped judgements with median value and target lemma.
@@ -19,11 +38,13 @@ judgments with calculated median values.
 def load_judgments(path):
     df = pd.DataFrame()
     judge_path = path + '/judgments.tsv'
-    df = pd.read_csv(judge_path, delimiter='\t')
+    # read from the Parquet copy of judgments.tsv if it is up to date
+    df = read_table(judge_path)
+    df['instanceID'] = infer_numeric(df['instanceID'])
 
 
-    # Replace null judgments with nan
-    df['label'] = df['label'].replace('-', np.NaN)
+    # Replace null and empty judgments with nan
+    df['label'] = df['label'].replace(['-', ''], np.nan)
     # Cast labels to floats
     df['label'] = df['label'].astype(float)
 
@@ -37,7 +58,7 @@ def load_judgments(path):
 
     # Get target lemma name from uses.tsv file
     use_path = path + '/uses.tsv'
-    uses = pd.read_csv(use_path, delimiter='\t')
+    uses = read_table(use_path, columns=['lemma'])
     lemma = uses.iloc[0]['lemma']
 
     return df, lemma
@@ -53,10 +74,11 @@ annotated data.
 def load_auto_annotation(path):
     df = pd.DataFrame()
     fn = path
-    df = pd.read_csv(fn, delimiter='\t')
+    df = read_table(fn)
+    df['instanceID'] = infer_numeric(df['instanceID'])
 
-    # Replace non labels with np.Nans
-    df['label'] = df['label'].replace('-', np.NaN)
+    # Replace non labels and empty labels with np.Nans
+    df['label'] = df['label'].replace(['-', ''], np.nan)
     # Cast labels to floats
     df['label'] = df['label'].astype(float)
 
@@ -103,6 +125,32 @@ def spearman(gold_list, auto_list):
     spearman = spearmanr(gold_list, auto_list, nan_policy='omit')
     return spearman.correlation
 
+'''
+Loads the graded change scores of lemmas, e.g. written by change_scores.py or the gold scores of a DWUG
+(stats_groupings.csv).
+
+INPUT[str]: A path to a tab-separated file with a lemma and a change_graded column.
+
+OUTPUT[pandas.DataFrame]: A pandas dataframe object with the lemma and its numeric change_graded score.
+'''
+def load_graded(path):
+    df = read_table(path, columns=['lemma', 'change_graded'])
+    df['change_graded'] = pd.to_numeric(df['change_graded'], errors='coerce')
+    return df
+
+'''
+Calculates the Spearman correlation between the graded change scores of the lemmas of two files. Lemmas
+without a score in both files are left out.
+
+INPUT[pandas.DataFrame, pandas.DataFrame]: The dataframe containing the gold scores and the dataframe
+containing the predicted scores.
+
+OUTPUT[float, int]: The correlation coefficient and the number of lemmas it is calculated from.
+'''
+def graded_spearman(gold_df, auto_df):
+    merged = gold_df.merge(auto_df, on='lemma', suffixes=('_gold', '_auto')).dropna()
+    return spearman(merged['change_graded_gold'].tolist(), merged['change_graded_auto'].tolist()), len(merged)
+
 '''
 Writes dictionary of results to an evaluation.tsv file.
 
@@ -121,6 +169,20 @@ def write_results(res_dict, path):
         dict_writer.writeheader()
         dict_writer.writerows(rows)
 
+'''
+Writes the result of the graded change evaluation to a graded_evaluation.tsv file.
+
+INPUT[float, int, str]: The Spearman correlation, the number of lemmas and the directory to write to.
+
+OUTPUT[None]: Writes the result to graded_evaluation.tsv file.
+'''
+def write_graded_results(sp, lemmas, path):
+    fn = os.path.join(path, 'graded_evaluation.tsv')
+    with open(fn, 'w') as f:
+        dict_writer = DictWriter(f, fieldnames=['sp', 'lemmas'], delimiter='\t')
+        dict_writer.writeheader()
+        dict_writer.writerow({'sp': sp, 'lemmas': lemmas})
+
 '''
 Main evalutation function. The script can be run from the comman line with 3 positional
 arguments: start_directory, auto_annotator_name (name convention for auto-annotated.tsv file),
@@ -131,6 +193,9 @@ file called data which holds subfolders containing (at minimum) judgments.tsv fi
 files, and auto-annotated data in the .tsv format. 2) Naming convention for auto annotated .tsv files
 (e.g. auto_annotation.tsv). 3) Selected evalutation metrics separated by commas (e.g. "krip, sp" for
 Krippendorf and Spearman).
+With --graded, the change_graded scores of a file written by change_scores.py are compared to gold
+scores instead, and the Spearman correlation is written to a graded_evaluation.tsv file in the start
+directory.
 
 OUTPUT[None]: Writes dictionary to evaluation.tsv file. 
 '''
@@ -139,10 +204,18 @@ def main():
     # Getting positional arguments from argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('start_directory', metavar='start_directory', type=str, help='Enter directory with uses and instances files')
-    parser.add_argument('auto_annotator_name', metavar='auto_annotator_name', type=str, help='Enter the file name with auto-annotated data (e.g. random_judgments.tsv')
-    parser.add_argument('metrics', metavar='metrics', type=str, help='Enter your preferred evluation metrics separated by commas (e.g. "sp, krip")')
+    parser.add_argument('auto_annotator_name', metavar='auto_annotator_name', type=str, nargs='?', help='Enter the file name with auto-annotated data (e.g. random_judgments.tsv')
+    parser.add_argument('metrics', metavar='metrics', type=str, nargs='?', help='Enter your preferred evluation metrics separated by commas (e.g. "sp, krip")')
+    parser.add_argument('--graded', nargs=2, metavar=('scores_file', 'gold_file'), help='Instead of judgments, compare the change_graded scores written by change_scores.py to a gold file with lemma and change_graded columns (e.g. stats_groupings.csv of a DWUG) by Spearman correlation')
     args = parser.parse_args()
     path = args.start_directory
+
+    if args.graded is not None:
+        sp, lemmas = graded_spearman(load_graded(args.graded[1]), load_graded(args.graded[0]))
+        write_graded_results(sp, lemmas, path)
+        return
+    if args.auto_annotator_name is None or args.metrics is None:
+        parser.error('auto_annotator_name and metrics are required without --graded')
     auto_fn = args.auto_annotator_name
 
     # Extract metrics from metrics string and put in list
@@ -161,9 +234,9 @@ def main():
     # Initialize results dictionary as defaultdict()
     res_dict = defaultdict(lambda: {'krip': None, 'sp': None})
 
-    # Open path to /data/ file and iterated over the sub folders
+    # Open path to /data/ file and iterate over the lemma folders listed in its catalog
     data_path = os.path.join(path, 'data')
-    for dir in tqdm(os.listdir(data_path)):
+    for dir in tqdm(catalog_lemmas(data_path)):
         f = os.path.join(data_path, dir)
         # Get judgments, lemma, and auto annotated data at each sub folder
         judgments, lemma = load_judgments(f)
@@ -1,11 +1,16 @@
 from __future__ import annotations
 from collections.abc import Iterable
 import os
-import csv
+import sys
 import random
 
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from compressed import exists
+from spans import decode_spans, span_lists
+from table_io import read_records
+
 class AnnotationProvider:
 
     def __init__(self, path: str, DEBUG: bool = False):
@@ -15,7 +20,8 @@ class AnnotationProvider:
         ----------
         path : str
             Path to the annotation files.
-            This directory should contain a file called 'uses.tsv' and 'instances.tsv'.
+            This directory should contain a file called 'uses.tsv' and 'instances.tsv'
+            (or their compressed variants 'uses.tsv.gz'/'uses.tsv.zst' etc.).
         DEBUG : bool, optional
             If set to True, the annotation provider will print debug messages, by default False
 
@@ -45,11 +51,11 @@ class AnnotationProvider:
             if DEBUG:
                 logging.warning(f"Path '{self._path}' does not exist.")
             raise FileNotFoundError(f"Path '{self._path}' does not exist.")
-        if not os.path.exists(os.path.join(self._path, 'uses.tsv')):
+        if not exists(os.path.join(self._path, 'uses.tsv')):
             if DEBUG:
                 logging.warning(f"Path '{self._path}' does not contain a uses file.")
             raise FileNotFoundError(f"Path '{self._path}' does not contain a 'uses.tsv' file.")
-        if not os.path.exists(os.path.join(self._path, 'instances.tsv')):
+        if not exists(os.path.join(self._path, 'instances.tsv')):
             if DEBUG:
                 logging.warning(f"Path '{self._path}' does not contain a instances file.")
             raise FileNotFoundError(f"Path '{self._path}' does not contain a 'instances.tsv' file.")
@@ -92,18 +98,21 @@ class AnnotationProvider:
         }
         """
         uses = {}
-        with open(os.path.join(self._path, 'uses.tsv'), 'r') as f:
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                if row['dataID'] in uses:
-                    raise ValueError(f"Duplicate dataID '{row['dataID']}' in uses file.")
-                uses[row['dataID']] = {
-                    'dataID': row['dataID'],
-                    'context': row['context'],
-                    'indices_target_token': [tuple(int(i) for i in index.split(':')) for index in row['indices_target_token'].split(',')],
-                    'indices_target_sentence': [tuple(int(i) for i in index.split(':')) for index in row['indices_target_sentence'].split(',')],
-                    'lemma': row['lemma'],
-                }
+        # read from the Parquet copy of uses.tsv if it is up to date
+        rows = list(read_records(os.path.join(self._path, 'uses.tsv')))
+        # parse the span columns at once instead of row by row
+        target_tokens = span_lists(*decode_spans(row['indices_target_token'] for row in rows))
+        target_sentences = span_lists(*decode_spans(row['indices_target_sentence'] for row in rows))
+        for row, target_token, target_sentence in zip(rows, target_tokens, target_sentences):
+            if row['dataID'] in uses:
+                raise ValueError(f"Duplicate dataID '{row['dataID']}' in uses file.")
+            uses[row['dataID']] = {
+                'dataID': row['dataID'],
+                'context': row['context'],
+                'indices_target_token': target_token,
+                'indices_target_sentence': target_sentence,
+                'lemma': row['lemma'],
+            }
         return uses
 
 
@@ -135,21 +144,20 @@ class AnnotationProvider:
         }
         """
         instances = {}
-        with open(os.path.join(self._path, 'instances.tsv'), 'r') as f:
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                if row['instanceID'] in instances:
-                    raise ValueError(f"Duplicate instanceID '{row['instanceID']}' in instances file.")
-                instances[row['instanceID']] = row.copy()
-                # Convert possible lists to lists
-                for key in row.keys():
-                    if len(row[key].split(',')) > 1:
-                        # Check if the list is a list of ints
-                        try:
-                            instances[row['instanceID']][key] = [int(i) for i in row[key].split(',')]
-                        except ValueError:
-                            instances[row['instanceID']][key] = row[key].split(',')
-                    
+        # read from the Parquet copy of instances.tsv if it is up to date
+        for row in read_records(os.path.join(self._path, 'instances.tsv')):
+            if row['instanceID'] in instances:
+                raise ValueError(f"Duplicate instanceID '{row['instanceID']}' in instances file.")
+            instances[row['instanceID']] = row.copy()
+            # Convert possible lists to lists
+            for key in row.keys():
+                if len(row[key].split(',')) > 1:
+                    # Check if the list is a list of ints
+                    try:
+                        instances[row['instanceID']][key] = [int(i) for i in row[key].split(',')]
+                    except ValueError:
+                        instances[row['instanceID']][key] = row[key].split(',')
+
         return instances
 
 
@@ -1,11 +1,15 @@
 import annotation_provider as ap
-import pandas as pd
 import os
+import sys
 import random
 import argparse
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from table_io import read_table
+
 def get_labels(path):
-    df = pd.read_csv(os.path.join(path, 'vocab.tsv'), delimiter='\t')
+    # vocab.tsv may be compressed (vocab.tsv.gz, vocab.tsv.zst)
+    df = read_table(os.path.join(path, 'vocab.tsv'), columns=['lemma'])
     return df['lemma'].to_list()
 
 def random_annotate(path, vocab):
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog import catalog_lemmas, lemma_dirs, read_catalog, write_catalog
+from table_io import TABLE_FILES, convert_tree, externalize_tree, inline_tree, restore_tree
+
+
+#*****************************************************************************
+# MAIN
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the .tsv files of a data directory to Parquet and back. The .tsv files stay the canonical version: the tools only read a Parquet file if it was made from the .tsv file as it is on disk.')
+    parser.add_argument('data_directory', metavar='data_directory', type=str, help='Directory containing the combined .tsv files and one folder per lemma (e.g. dwug_en/data)')
+    parser.add_argument('--to', choices=['parquet', 'tsv'], help='parquet: write missing or outdated Parquet copies, tsv: restore missing .tsv files from their Parquet copies (default: parquet, unless --contexts is given)')
+    parser.add_argument('--tables', type=str, default=','.join(TABLE_FILES), help='Comma-separated list of the tables to convert (default: %(default)s)')
+    parser.add_argument('--force', action='store_true', help='Rewrite all files, not only missing or outdated ones')
+    parser.add_argument('--catalog', action='store_true', help='Also rebuild catalog.tsv from the lemma folders found on disk, e.g. for data directories written by older converters')
+    parser.add_argument('--contexts', choices=['store', 'inline'], help='store: move the contexts of the uses.tsv files into the context store given by --store, inline: write referenced contexts back into the files')
+    parser.add_argument('--store', type=str, help='Directory of the context store for --contexts store, shared by all data directories moved into it (default: the data directory)')
+    args = parser.parse_args()
+
+    file_names = [name.strip() for name in args.tables.split(',') if name.strip()]
+    start = time.perf_counter()
+    if args.contexts is not None:
+        if args.contexts == 'store':
+            rewritten = externalize_tree(args.data_directory, args.store or args.data_directory)
+        else:
+            rewritten = inline_tree(args.data_directory)
+        print(f'rewrote the contexts of {len(rewritten)} files')
+        # the rewritten files have a new size and hash
+        if read_catalog(args.data_directory) is not None and not args.catalog:
+            changed = [os.path.basename(os.path.dirname(tsv)) for tsv in rewritten]
+            entries = read_catalog(args.data_directory)
+            write_catalog(args.data_directory, list(dict.fromkeys(e['file'] for e in entries)),
+                          catalog_lemmas(args.data_directory), changed)
+    if args.to == 'parquet' or args.to is None and args.contexts is None:
+        written = convert_tree(args.data_directory, file_names, args.force)
+        print(f'wrote {len(written)} files in {time.perf_counter() - start:.1f}s')
+    elif args.to == 'tsv':
+        written = restore_tree(args.data_directory, file_names, args.force)
+        print(f'wrote {len(written)} files in {time.perf_counter() - start:.1f}s')
+
+    if args.catalog:
+        entries = write_catalog(args.data_directory, file_names, lemma_dirs(args.data_directory))
+        print(f'catalogued {len(entries)} files')
+
+
+if __name__ == '__main__':
+    main()
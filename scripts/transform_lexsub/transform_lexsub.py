@@ -1,78 +1,26 @@
-import xml.etree.ElementTree as et 
 import pandas as pd
-import regex as re
 import os
+import sys
 import argparse
-import requests
 import gzip
-import zipfile
-from io import BytesIO
-import tarfile
+import heapq
+import io
 import csv
+from collections import Counter
 
-#####################################################################################################################
-# Download the data
-def get_mc_data(url, path):
-    req = requests.get(url)
-    f = BytesIO(req.content)
-    file = tarfile.open(fileobj=f, mode='r')
-    file.extractall(path)
-    xml_file = os.path.join(path, 'Data/lexsub_wcdata.xml')
-    with open(xml_file, 'r') as f:
-        filedata = f.read()
-        filedata = filedata.replace('&#8221 ;','&#8221;')
-    with open(xml_file,'w') as f:
-        f.write(filedata)
-
-def clean_use(use):
-    xmlstr = et.tostring(use, encoding='unicode', method='xml')
-    xml_lst = re.split('<(.*?)>', xmlstr)
-    return [xml_lst[4].strip(), xml_lst[6].strip(), xml_lst[8].strip(), xml_lst[10].strip(), xml_lst[12].strip()]
-
-def get_context(txt_lst):
-    return ' '.join(txt_lst)
-
-def get_targ_idx(txt_lst):
-    start = len(txt_lst[0]) + len(txt_lst[1]) + 2
-    end = start + len(txt_lst[2]) + 1
-    return str(start) + ':' + str(end)
-
-def get_targ_sent(txt_lst):
-    targ_sent = txt_lst[1] + ' ' + txt_lst[2] + ' ' + txt_lst[3]
-    start = len(txt_lst[0]) + 1
-    end = start + len(targ_sent)
-    return str(start) + ':' + str(end)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from compressed import open_text
+from download import fetch
+from mccarthy import MC_URL, XML_FILE, get_mc_data, parse_uses, write_tables
+from zip_source import open_archive
 
-#####################################################################################################################
-# Make the uses
-def make_uses(xml_file, file_path):
-    tree = et.parse(xml_file)
-    root = tree.getroot()
-    cols = ['dataID', 'context', 'indices_target_token', 'indices_target_sentence', 'lemma']
-    rows = []
-
-    for i in root:
-        lemma = i.attrib['item']
-        for use in i.findall('instance'):
-            dataID = use.attrib['id']
-            txt_lst = clean_use(use)
-            context = get_context(txt_lst)
-            indices_target_token = get_targ_idx(txt_lst)
-            indices_target_sentence = get_targ_sent(txt_lst)
-            rows.append({'dataID': dataID, 'context': context, 'indices_target_token': indices_target_token, 
-            'indices_target_sentence': indices_target_sentence, 'lemma': lemma})
-            
-    df = pd.DataFrame(rows, columns=cols)
-    lemmas = sorted(list(set(df['lemma'].tolist())))
-    for lem in lemmas:
-        rslt_df = df[df['lemma'] == lem]
-        os.mkdir(os.path.join(file_path, lem))
-        output_dir = os.path.join(file_path, lem, 'uses.tsv')
-        rslt_df.to_csv(output_dir, sep='\t', quoting=csv.QUOTE_NONE, index=False)
+# Increase when a change to the transform changes its output, so that all lemmas are regenerated
+CONVERTER_VERSION = '1'
+JUDGMENTS_CSV = 'Markup/SynonymBest/synbestratings.csv'
 
 #####################################################################################################################
 # Make the judgments
-def make_judgments(csv_file, file_path):
+def make_judgments(csv_file):
     # read csv file
     judgments = pd.read_csv(csv_file)
     # get instance ids
@@ -88,94 +36,113 @@ def make_judgments(csv_file, file_path):
     # make transformed dataframe
     transformed = pd.DataFrame(list(zip(inst_ids, labels, comments, annotator, lemmas)), columns=names)
     
-    # write subsets of dataframe to corresponding lemma folder
-    for lemma in list(set(transformed['lemma'].to_list())):
-        # filter by lemma
-        filtered_df = transformed[transformed['lemma'] == lemma]
-        # drop lemma column
-        filtered_df = filtered_df.drop('lemma', axis=1)
-        # write judgments.tsv file to lemma folder
-        output_dir = os.path.join(file_path, lemma, 'judgments.tsv')
-        filtered_df.to_csv(output_dir, sep='\t', quoting=csv.QUOTE_NONE, index=False)
+    return transformed
 
 ######################################################################################################################
 # Make the instances
 
-def make_instances(path):
+def make_instances(judgments):
     label_set = ''
-    cols = ['instanceID', 'dataIDs', 'label_set', 'non_label']
-    for dir in os.listdir(path):
-        f = os.path.join(path, dir)
-        df = pd.read_csv(os.path.join(f, 'judgments.tsv'), sep='\t', quoting=csv.QUOTE_NONE)
-
-        # get data for instance df
-        instance_ids = df['instanceID'].to_list()
-        non_label = ['-' for i in range(len(instance_ids))]
-        labels = [label_set for i in range(len(instance_ids))]
-        data_ids = instance_ids
-
-        new_df = pd.DataFrame(list(zip(instance_ids, data_ids, labels, non_label)), columns=cols)
-        new_df = new_df.drop_duplicates(subset=['instanceID'])
-        new_df.to_csv(os.path.join(f, 'instances.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-
-#*****************************************************************************
-# Concat files
-
-def concat_mc(path):
-    uses = pd.DataFrame()
-    instances = pd.DataFrame()
-    judgments = pd.DataFrame()
-
-    for dir in os.listdir(path):
-        f = os.path.join(path, dir)
-
-        # Get paths to datafiles
-        use_path = os.path.join(f, 'uses.tsv')
-        inst_path = os.path.join(f, 'instances.tsv')
-        judge_path = os.path.join(f, 'judgments.tsv')
-
-        # Create dataframes from paths
-        use_frame = pd.read_csv(use_path, delimiter='\t', quoting=csv.QUOTE_NONE)
-        inst_frame = pd.read_csv(inst_path, delimiter='\t', quoting=csv.QUOTE_NONE)
-        judge_frame = pd.read_csv(judge_path, delimiter='\t', quoting=csv.QUOTE_NONE)
-
-        # Concat frames
-        uses = pd.concat([uses, use_frame])
-        instances = pd.concat([instances, inst_frame])
-        judgments = pd.concat([judgments, judge_frame])
-    
-    uses.to_csv(os.path.join(path, 'uses.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-    instances.to_csv(os.path.join(path, 'instances.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-    judgments.to_csv(os.path.join(path, 'judgments.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
+    # one instance per judged instance id of each lemma
+    instances = judgments[['instanceID', 'lemma']].drop_duplicates()
+    data_ids = instances['instanceID']
+    return pd.DataFrame({'instanceID': instances['instanceID'], 'dataIDs': data_ids, 'label_set': label_set,
+                         'non_label': '-', 'lemma': instances['lemma']})
 
 
 #*****************************************************************************
 # VOCAB FOR RAND ANNOTATOR
 
-def get_corpus():
-    url = 'https://www2.ims.uni-stuttgart.de/data/sem-eval-ulscd/semeval2020_ulscd_eng.zip'
-    req = requests.get(url)
-    zip_file = zipfile.ZipFile(BytesIO(req.content))
-    zip_file.extractall()
-    
-    f = 'semeval2020_ulscd_eng/corpus2/lemma/ccoha2.txt.gz'
-    with gzip.open(f, 'rb') as file:
-        content = file.read()
-    
-    return content.decode("utf-8").split('\n')
-
-def make_vocab(content):
-    vocab = []
-    for sent in content:
-        vocab.extend(sent.split())
-    vocab = list(set(vocab))
+# The default corpus the vocabulary is built from, a member of the SemEval-2020 English archive
+CORPUS_URL = 'https://www2.ims.uni-stuttgart.de/data/sem-eval-ulscd/semeval2020_ulscd_eng.zip'
+CORPUS_MEMBER = 'semeval2020_ulscd_eng/corpus2/lemma/ccoha2.txt.gz'
+
+def get_corpus(url=CORPUS_URL, member=CORPUS_MEMBER):
+    # the corpus is read from the archive, it is not extracted
+    return (fetch(url), member)
+
+'''
+Opens a corpus as a text stream of whitespace-separated tokens, one sentence per line. Gzip files are
+decompressed while they are read.
+
+INPUT: (str or tuple), a path to a text or .gz file, or a (zip archive, member) pair.
+OUTPUT: (io.TextIOBase), the opened corpus.
+'''
+def open_corpus(corpus):
+    if isinstance(corpus, str):
+        f = open(corpus, 'rb')
+        name = corpus
+    else:
+        archive, name = corpus
+        f = open_archive(archive).open(name)
+    if name.endswith('.gz'):
+        f = gzip.GzipFile(fileobj=f, mode='rb')
+    return io.TextIOWrapper(f, encoding='utf-8')
+
+'''
+Counts the tokens of one or more corpora. The corpora are streamed line by line, so memory use depends on the
+size of the vocabulary and not on the size of the corpora.
+
+INPUT: (list), the corpora, see open_corpus.
+OUTPUT: (collections.Counter), the frequency of each token.
+'''
+def count_tokens(corpora):
+    counts = Counter()
+    for corpus in corpora:
+        with open_corpus(corpus) as f:
+            for line in f:
+                counts.update(line.split())
+    return counts
+
+'''
+Selects the vocabulary from the token frequencies.
+
+INPUT: (collections.Counter, int, int), the token frequencies, the minimum frequency of a token and optionally
+the maximum number of tokens, the most frequent ones are kept.
+OUTPUT: (list), the (lemma, frequency) pairs, sorted by lemma.
+'''
+def make_vocab(counts, min_freq=1, top_k=None):
+    vocab = [(lemma, freq) for lemma, freq in counts.items() if freq >= min_freq]
+    if top_k is not None:
+        vocab = heapq.nsmallest(top_k, vocab, key=lambda item: (-item[1], item[0]))
     vocab.sort()
     return vocab
 
 
 def vocab_to_tsv(vocab, path):
-    df = pd.DataFrame({'lemma':vocab})
-    df.to_csv(os.path.join(path, 'vocab.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
+    df = pd.DataFrame(vocab, columns=['lemma', 'frequency'])
+    with open_text(os.path.join(path, 'vocab.tsv'), 'w') as f:
+        df.to_csv(f, sep='\t', quoting=csv.QUOTE_NONE, index=False)
+
+
+#####################################################################################################################
+# Transform the parsed uses and the judgments to the LEXSUB format
+'''
+Builds the LEXSUB tables in memory from the parsed uses and the judgments csv file. The instances are derived
+from the judgments table, nothing is read back from disk.
+
+INPUT: (pandas.DataFrame, str), the parsed uses and the directory of the extracted cl-meaningincontext data.
+OUTPUT: (dict), the uses, judgments and instances tables, each with a lemma column.
+'''
+def make_tables(uses, original_data):
+    # path to judgments csv
+    judge_csv = os.path.join(original_data, JUDGMENTS_CSV)
+    # transform judgments
+    judgments = make_judgments(judge_csv)
+    return {
+        'uses': uses,
+        'judgments': judgments,
+        'instances': make_instances(judgments),
+    }
+
+def transform(uses, original_data, start_path, index=False, parquet=False, corpora=None, min_freq=1, top_k=None, context_store=None):
+    # write all tables once, only lemmas whose data changed since the last run are written to their folders
+    write_tables(make_tables(uses, original_data), start_path, CONVERTER_VERSION, index, parquet, context_store)
+
+    # make vocab
+    counts = count_tokens(corpora or [get_corpus()])
+    vocab = make_vocab(counts, min_freq, top_k)
+    vocab_to_tsv(vocab, start_path)
 
 
 #*****************************************************************************
@@ -185,33 +152,23 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('data_to_format', metavar='data_to_format', type=str, help='directory to download cl-meaningincontext data')
     parser.add_argument('start_directory', metavar='start_directory', type=str, help='Enter directory to download transformed data')
+    parser.add_argument('--index', action='store_true', help='Write a per-lemma row-offset index next to the concatenated files')
+    parser.add_argument('--parquet', action='store_true', help='Also write a Parquet copy of every .tsv file (requires pyarrow)')
+    parser.add_argument('--corpus', action='append', dest='corpora', help='Text or .gz corpus to build the vocabulary from, can be given several times (default: the SemEval-2020 English corpus)')
+    parser.add_argument('--min-freq', type=int, default=1, help='Minimum frequency of a vocabulary lemma (default: %(default)s)')
+    parser.add_argument('--top-k', type=int, default=None, help='Keep only the K most frequent lemmas in the vocabulary')
+    parser.add_argument('--context-store', type=str, default=None, help='Store the contexts once in a context store in this directory and reference them from uses.tsv')
     args = parser.parse_args()
     original_data = args.data_to_format
     start_path = args.start_directory
 
     # download cl-meaninngincontext data
-    get_mc_data('http://www.dianamccarthy.co.uk/downloads/WordMeaningAnno2012/cl-meaningincontext.tgz', original_data)
-
-    # transform uses
-    xml_file = os.path.join(original_data, 'Data/lexsub_wcdata.xml')
-    make_uses(xml_file, start_path)
-    # path to judgments csv
-    judge_csv = os.path.join(original_data, 'Markup/SynonymBest/synbestratings.csv')
-    # transform judgments
-    make_judgments(judge_csv, start_path)
-    # make instances
-    make_instances(start_path)
-
-    # concat files
-    concat_mc(start_path)
-
-    # make vocab
-    content = get_corpus()
-    vocab = make_vocab(content)
-    vocab_to_tsv(vocab, start_path)
+    get_mc_data(MC_URL, original_data)
 
+    # parse uses
+    uses = parse_uses(os.path.join(original_data, XML_FILE))
+    transform(uses, original_data, start_path, args.index, args.parquet, args.corpora, args.min_freq, args.top_k, args.context_store)
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from mccarthy import MC_URL, XML_FILE, get_mc_data, parse_uses
+
+# The transforms sharing the uses of lexsub_wcdata.xml, each written to a subdirectory of the same name
+TASKS = ['lexsub', 'wsbest', 'wssim']
+
+for task in TASKS:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'transform_' + task))
+
+'''
+Runs the transform of one task on the parsed uses.
+
+INPUT: (str, pandas.DataFrame, str, str, bool, bool, str), the task, the parsed uses, the directory of the extracted
+cl-meaningincontext data, the directory to write the transformed data to, whether to write an index, whether to
+write Parquet copies of the .tsv files and optionally the directory of a context store shared by the tasks.
+OUTPUT: (float), the seconds the transform took.
+'''
+def run_task(task, uses, original_data, start_path, index=False, parquet=False, context_store=None):
+    start = time.perf_counter()
+    module = importlib.import_module('transform_' + task)
+    module.transform(uses, original_data, os.path.join(start_path, task), index, parquet, context_store=context_store)
+    return time.perf_counter() - start
+
+
+#*****************************************************************************
+# MAIN
+
+def main():
+    parser = argparse.ArgumentParser(description='Transform the cl-meaningincontext data to the LEXSUB, WSBEST and WSSIM formats, parsing the uses only once.')
+    parser.add_argument('data_to_format', metavar='data_to_format', type=str, help='directory to download cl-meaningincontext data')
+    parser.add_argument('start_directory', metavar='start_directory', type=str, help='Enter directory to download transformed data')
+    parser.add_argument('--tasks', type=str, default=','.join(TASKS), help='Comma-separated list of the tasks to transform (default: %(default)s)')
+    parser.add_argument('--index', action='store_true', help='Write a per-lemma row-offset index next to the concatenated files')
+    parser.add_argument('--parquet', action='store_true', help='Also write a Parquet copy of every .tsv file (requires pyarrow)')
+    parser.add_argument('--context-store', nargs='?', const='', default=None, help='Store every context once in a context store shared by the tasks, in the given directory (default: the start directory)')
+    args = parser.parse_args()
+    original_data = args.data_to_format
+    start_path = args.start_directory
+
+    tasks = [task.strip() for task in args.tasks.split(',') if task.strip()]
+    unknown = [task for task in tasks if task not in TASKS]
+    if unknown:
+        parser.error(f"unknown task(s) {', '.join(unknown)}, choose from {', '.join(TASKS)}")
+
+    # download cl-meaninngincontext data
+    get_mc_data(MC_URL, original_data)
+
+    # parse uses once for all tasks
+    start = time.perf_counter()
+    uses = parse_uses(os.path.join(original_data, XML_FILE))
+    print(f'parsed {len(uses)} uses in {time.perf_counter() - start:.1f}s')
+
+    # the tasks share the uses, so a shared store keeps every context once
+    context_store = start_path if args.context_store == '' else args.context_store
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = {task: executor.submit(run_task, task, uses, original_data, start_path, args.index, args.parquet, context_store) for task in tasks}
+        for task, future in futures.items():
+            try:
+                print(f'{task}: {future.result():.1f}s')
+            except Exception as e:
+                errors[task] = f'{type(e).__name__}: {e}'
+                print(f'{task}: failed ({errors[task]})')
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,51 @@
-import requests
-import zipfile
-from io import BytesIO
 import os
 import csv
+import numpy as np
 import pandas as pd
 import argparse
 import shutil
+import sys
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog import write_catalog
+from download import fetch
+from manifest import Manifest
+from zip_source import lemma_members, open_source, source_digest
+from compressed import open_text
+from table_io import convert_tree
+from tsv_concat import concat_tree
+
+# Increase when a change to the converter changes its output, so that all lemmas are regenerated
+CONVERTER_VERSION = '1'
+SOURCE_FILES = ['uses.csv', 'senses.csv', 'judgments_senses.csv']
+OUTPUT_FILES = ['uses.tsv', 'senses.tsv', 'instances.tsv', 'judgments.tsv']
+
 '''
 DOWNLOAD THE DATA
 '''
-def download_dwug(path):
+# The archive is downloaded to path (through the download cache) and not extracted, the csv files are read
+# straight from its members
+def download_dwug(path, cache_dir=None):
     url = 'https://zenodo.org/record/7441645/files/dwug_de.zip?download=1'
-    req = requests.get(url)
-    zip_file = zipfile.ZipFile(BytesIO(req.content))
-    zip_file.extractall(path)
+    cached = fetch(url, cache_dir=cache_dir)
+    os.makedirs(path, exist_ok=True)
+    archive = os.path.join(path, 'dwug_de.zip')
+    if os.path.exists(archive):
+        os.remove(archive)
+    try:
+        os.link(cached, archive)
+    except OSError:
+        shutil.copyfile(cached, archive)
+    return archive
 #--------------------------------------------------------------------------------------------------------
 '''
 TRANSFORM DATA TO OUR FORMAT AS DICTIONARIES
 '''
-# Extract the uses data
+# Extract the uses data (path is a directory or a (zip archive, member folder) pair)
 def transform_uses(path):
-    fn = path
     uses = {}
-    with open(os.path.join(fn, 'uses.csv'), 'r') as f:
+    with open_source(path, 'uses.csv') as f:
         reader = csv.DictReader(f, delimiter='\t',quoting=csv.QUOTE_NONE,strict=True)
         for row in reader:
             uses[row['identifier']] = {
@@ -40,9 +61,8 @@ def transform_uses(path):
         return uses, lem
 # Extract senses data
 def transform_senses(path, lemma):
-    fn = path
     senses = {}
-    with open(os.path.join(fn, 'senses.csv'), 'r') as f:
+    with open_source(path, 'senses.csv') as f:
         reader = csv.DictReader(f, delimiter='\t',quoting=csv.QUOTE_NONE,strict=True)
         for row in reader:
             senses[row['identifier_sense']] = {
@@ -53,58 +73,61 @@ def transform_senses(path, lemma):
     return senses
 
 # Extract instances data
-def make_instance(path, senses):
-    judge_path = os.path.join(path, 'judgments_senses.csv')
-    judgments = pd.read_csv(judge_path, delimiter='\t')
+def make_instance(path, senses, out_path):
+    with open_source(path, 'judgments_senses.csv') as f:
+        judgments = pd.read_csv(f, delimiter='\t', dtype={'identifier': str})
     judgments = judgments.loc[judgments['annotator'] == 'annotatorA']
     # get unique use ids
-    ids = judgments['identifier'].to_list()
+    ids = judgments['identifier'].drop_duplicates().to_numpy()
 
-    res = pd.DataFrame(columns=['instanceID', 'dataIDs', 'label_set', 'non_label'])
+    # build the use x sense cross product in one step, senses vary fastest
+    use_ids = pd.Series(np.repeat(ids, len(senses)))
+    sense_ids = pd.Series(np.tile(np.asarray(senses, dtype=object), len(ids)))
 
-    for use_id in ids:
-        for sense in senses:
-            instanceID = sense + '-' + use_id
-            dataIDs = sense + ',' + use_id
-            label_set = '0,1'
-            non_label = '-'
-            res.loc[len(res)] = [instanceID, dataIDs, label_set, non_label]
-    
-    res.to_csv(os.path.join(path, 'instances.tsv'), sep='\t', index=False)
+    res = pd.DataFrame({
+        'instanceID': sense_ids + '-' + use_ids,
+        'dataIDs': sense_ids + ',' + use_ids,
+        'label_set': '0,1',
+        'non_label': '-',
+    }, columns=['instanceID', 'dataIDs', 'label_set', 'non_label'])
+
+    with open_text(os.path.join(out_path, 'instances.tsv'), 'w') as f:
+        res.to_csv(f, sep='\t', index=False)
 
 # Extract judgments data
 
-def make_judgments(path):
-    judge_path = os.path.join(path, 'judgments_senses.csv')
-    inst_path = os.path.join(path, 'instances.tsv')
-    j_df = pd.read_csv(judge_path, delimiter='\t')
-    inst = pd.read_csv(inst_path, delimiter='\t')
-
-    annotators = list(set(j_df['annotator'].tolist()))
-    annotators.sort()
-    res = pd.DataFrame(columns=['instanceID', 'label', 'comment', 'annotator'])
-    for annotator in annotators:
-        for id in inst['dataIDs'].tolist():
-            data_id = id.split(',')[1]
-            by_id = j_df.loc[(j_df['identifier'] == data_id) & (j_df['annotator'] == annotator)]
-            chosen_sense = by_id['identifier_sense'].to_list()[0]
-            label = ''
-            comment = '-'
-            if chosen_sense == 'None':
-                label = '-'
-                comment = by_id['comment'].tolist()[0]
-            elif chosen_sense == id.split(',')[0]:
-                label = 1
-                comment = by_id['comment'].tolist()[0]
-                if comment == ' ' or comment == '':
-                    comment = '-'
-            else:
-                label = 0
-            
-            new_row = [id, label, comment, annotator]
-            res.loc[len(res)] = new_row
-            
-    res.to_csv(os.path.join(path, 'judgments.tsv'), sep='\t', index=False)
+def make_judgments(path, out_path):
+    inst_path = os.path.join(out_path, 'instances.tsv')
+    with open_source(path, 'judgments_senses.csv') as f:
+        j_df = pd.read_csv(f, delimiter='\t', dtype=str, keep_default_na=False)
+    with open_text(inst_path) as f:
+        inst = pd.read_csv(f, delimiter='\t', dtype=str, keep_default_na=False)
+
+    # index the first judgment of every (use, annotator) pair once
+    j_df = j_df.drop_duplicates(subset=['identifier', 'annotator']).set_index(['identifier', 'annotator'])
+    annotators = sorted(j_df.index.get_level_values('annotator').unique())
+
+    # annotators x instances, instances vary fastest
+    ids = inst['dataIDs'].to_numpy()
+    pairs = inst['dataIDs'].str.split(',', n=1, expand=True)
+    res = pd.DataFrame({
+        'instanceID': np.tile(ids, len(annotators)),
+        'sense': np.tile(pairs[0].to_numpy(), len(annotators)),
+        'identifier': np.tile(pairs[1].to_numpy(), len(annotators)),
+        'annotator': np.repeat(annotators, len(ids)),
+    })
+    # join the chosen sense and comment, pairs without a judgment are dropped
+    res = res.join(j_df[['identifier_sense', 'comment']], on=['identifier', 'annotator'], how='inner')
+
+    no_sense = res['identifier_sense'] == 'None'
+    chosen = res['identifier_sense'] == res['sense']
+    blank = res['comment'].isin([' ', ''])
+    res['label'] = np.select([no_sense, chosen], ['-', '1'], default='0')
+    res['comment'] = np.where(no_sense | (chosen & ~blank), res['comment'], '-')
+
+    res = res[['instanceID', 'label', 'comment', 'annotator']]
+    with open_text(os.path.join(out_path, 'judgments.tsv'), 'w') as f:
+        res.to_csv(f, sep='\t', index=False)
 
 #--------------------------------------------------------------------------------------------------------
 '''
@@ -117,7 +140,7 @@ def write_uses_tsv(uses_dict, path):
     keys = ['dataID', 'context', 'indices_target_token', 'indices_target_sentence', 'lemma']
     rows = uses_dict.values()
 
-    with open(fn, 'w') as f:
+    with open_text(fn, 'w') as f:
         dict_writer = csv.DictWriter(f, fieldnames=keys, delimiter='\t')
         dict_writer.writeheader()
         dict_writer.writerows(rows)
@@ -128,13 +151,15 @@ def write_senses_tsv(senses_dict, path):
     keys = ['senseID', 'definition', 'lemma']
     rows = senses_dict.values()
 
-    with open(fn, 'w') as f:
+    with open_text(fn, 'w') as f:
         dict_writer = csv.DictWriter(f, fieldnames=keys, delimiter='\t')
         dict_writer.writeheader()
         dict_writer.writerows(rows)
 
 
-def transform_dwug(path):
+def transform_dwug(path, out_path=None):
+    if out_path is None:
+        out_path = path
     uses, lem = transform_uses(path)
     senses = transform_senses(path, lem)
     
@@ -144,45 +169,16 @@ def transform_dwug(path):
     #instances = transform_instances(path, label_set)
     #judgments = transform_sense_judgments(path, instances)
 
-    write_uses_tsv(uses, path)
-    write_senses_tsv(senses, path)
-    make_instance(path, sense_set)
-    make_judgments(path)
+    write_uses_tsv(uses, out_path)
+    write_senses_tsv(senses, out_path)
+    make_instance(path, sense_set, out_path)
+    make_judgments(path, out_path)
 
     pass
 #--------------------------------------------------------------------------------------------------------
 '''CONCATENATE DATA'''
-def concat_dwugs(path):
-    uses = pd.DataFrame()
-    senses = pd.DataFrame()
-    instances = pd.DataFrame()
-    judgments = pd.DataFrame()
-
-    for dir in os.listdir(path):
-        f = os.path.join(path, dir)
-
-        # Get paths to datafiles
-        use_path = os.path.join(f, 'uses.tsv')
-        sense_path = os.path.join(f, 'senses.tsv')
-        inst_path = os.path.join(f, 'instances.tsv')
-        judge_path = os.path.join(f, 'judgments.tsv')
-
-        # Create dataframes from paths
-        use_frame = pd.read_csv(use_path, delimiter='\t')
-        sense_frame = pd.read_csv(sense_path, delimiter='\t')
-        inst_frame = pd.read_csv(inst_path, delimiter='\t')
-        judge_frame = pd.read_csv(judge_path, delimiter='\t')
-
-        # Concat frames
-        uses = pd.concat([uses, use_frame])
-        senses = pd.concat([senses, sense_frame])
-        instances = pd.concat([instances, inst_frame])
-        judgments = pd.concat([judgments, judge_frame])
-    
-    uses.to_csv(os.path.join(path, 'uses.tsv'), sep='\t', index=False)
-    senses.to_csv(os.path.join(path, 'senses.tsv'), sep='\t', index=False)
-    instances.to_csv(os.path.join(path, 'instances.tsv'), sep='\t', index=False)
-    judgments.to_csv(os.path.join(path, 'judgments.tsv'), sep='\t', index=False)
+def concat_dwugs(path, lemmas=None, index=False):
+    concat_tree(path, ['uses.tsv', 'senses.tsv', 'instances.tsv', 'judgments.tsv'], lemmas, index)
 #--------------------------------------------------------------------------------------------------------
 #--------------------------------------------------------------------------------------------------------
 '''MAIN FUNCTION'''
@@ -192,38 +188,39 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('start_directory', metavar='start_directory', type=str, help='Enter directory to download data')
     parser.add_argument('destination', metavar='destination', type=str, help='Where new data folder will be')
+    parser.add_argument('--index', action='store_true', help='Write a per-lemma row-offset index next to the concatenated files')
+    parser.add_argument('--parquet', action='store_true', help='Also write a Parquet copy of every .tsv file (requires pyarrow)')
     args = parser.parse_args()
     path = args.start_directory
     new_path = args.destination
 
     # Download the data
-    download_dwug(path)
-    dwug_path = os.path.join(path, 'dwug_de/misc/dwug_de_sense/data')
-
-    for dir in tqdm(os.listdir(dwug_path)):
-        f = os.path.join(dwug_path, dir)
-
-        # remove extra files (maj_2, maj_3)
-        maj2 = os.path.join(f, 'maj_2')
-        maj3 = os.path.join(f, 'maj_3')
-        shutil.rmtree(maj2)
-        shutil.rmtree(maj3)
-
-        # transform dwug data
-        transform_dwug(f)
-        
-        # Cleanup
-        for file_name in os.listdir(f):
-            if file_name.endswith('.csv'):
-                os.remove(os.path.join(f, file_name))
-                
-    # Concatenate files
-    concat_dwugs(dwug_path)
-    
-    original = dwug_path
-    new = new_path
-    shutil.move(original, new)
-    shutil.rmtree(os.path.join(path, 'dwug_de'))
-        
+    archive = download_dwug(path)
+    sources = lemma_members(archive, 'dwug_de/misc/dwug_de_sense/data')
+    os.makedirs(new_path, exist_ok=True)
+    manifest = Manifest(new_path, CONVERTER_VERSION)
+    converted = []
+
+    for lemma, folder in tqdm(sources.items()):
+        # skip lemmas whose sources and outputs did not change since the last run
+        digest = source_digest((archive, folder), SOURCE_FILES)
+        if manifest.is_current(lemma, OUTPUT_FILES, digest):
+            continue
+
+        # transform dwug data straight from the archive members
+        f = os.path.join(new_path, lemma)
+        os.makedirs(f, exist_ok=True)
+        transform_dwug((archive, folder), f)
+        manifest.record(lemma, OUTPUT_FILES, digest)
+        converted.append(lemma)
+
+    manifest.save()
+
+    # Concatenate and catalog files
+    concat_dwugs(new_path, list(sources), args.index)
+    write_catalog(new_path, OUTPUT_FILES, list(sources), converted)
+    if args.parquet:
+        convert_tree(new_path)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,84 +1,21 @@
 import csv
-import xml.etree.ElementTree as et 
 import pandas as pd
-import regex as re
 import os
+import sys
 import argparse
-import nltk
-from nltk.corpus import wordnet as wn
-import requests
-from io import BytesIO
-import tarfile
 
-#******************************************************#
-#DOWNLOAD DATA
-
-def get_mc_data(url, path):
-    req = requests.get(url)
-    f = BytesIO(req.content)
-    file = tarfile.open(fileobj=f, mode='r')
-    file.extractall(path)
-    xml_file = os.path.join(path, 'Data/lexsub_wcdata.xml')
-    with open(xml_file, 'r') as f:
-        filedata = f.read()
-        filedata = filedata.replace('&#8221 ;','&#8221;')
-    with open(xml_file,'w') as f:
-        f.write(filedata)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from mccarthy import MC_URL, XML_FILE, get_mc_data, parse_uses, write_tables
+from wordnet_cache import resolve_definitions
 
-#******************************************************#
-#USES
-
-def clean_use(use):
-    xmlstr = et.tostring(use, encoding='unicode', method='xml')
-    xml_lst = re.split('<(.*?)>', xmlstr)
-    return [xml_lst[4].strip(), xml_lst[6].strip(), xml_lst[8].strip(), xml_lst[10].strip(), xml_lst[12].strip()]
-
-def get_context(txt_lst):
-    return ' '.join(txt_lst)
-
-def get_targ_idx(txt_lst):
-    start = len(txt_lst[0]) + len(txt_lst[1]) + 2
-    end = start + len(txt_lst[2]) + 1
-    return str(start) + ':' + str(end)
-
-def get_targ_sent(txt_lst):
-    targ_sent = txt_lst[1] + ' ' + txt_lst[2] + ' ' + txt_lst[3]
-    start = len(txt_lst[0]) + 1
-    end = start + len(targ_sent)
-    return str(start) + ':' + str(end)
-
-
-def make_uses(xml_file, file_path):
-    tree = et.parse(xml_file)
-    root = tree.getroot()
-    cols = ['dataID', 'context', 'indices_target_token', 'indices_target_sentence', 'lemma']
-    rows = []
-
-    for i in root:
-        lemma = i.attrib['item']
-        for use in i.findall('instance'):
-            dataID = use.attrib['id']
-            txt_lst = clean_use(use)
-            context = get_context(txt_lst)
-            indices_target_token = get_targ_idx(txt_lst)
-            indices_target_sentence = get_targ_sent(txt_lst)
-            rows.append({'dataID': dataID, 'context': context, 'indices_target_token': indices_target_token, 
-            'indices_target_sentence': indices_target_sentence, 'lemma': lemma})
-            
-    
-    df = pd.DataFrame(rows, columns=cols)
-    lemmas = sorted(list(set(df['lemma'].tolist())))
-
-    for lem in lemmas:
-        rslt_df = df[df['lemma'] == lem]
-        os.mkdir(os.path.join(file_path, lem))
-        output_dir = os.path.join(file_path, lem, 'uses.tsv')
-        rslt_df.to_csv(output_dir, sep='\t', quoting=csv.QUOTE_NONE, index=False)
+# Increase when a change to the transform changes its output, so that all lemmas are regenerated
+CONVERTER_VERSION = '1'
+JUDGMENTS_CSV = 'Markup/WordSenseSimilarity/wssim2ratings.csv'
 
 #******************************************************#
 # JUDGMENTS
 
-def make_judgments(csv_file, file_path):
+def make_judgments(csv_file):
     # read csv file
     judgments = pd.read_csv(csv_file)
     # get instance ids
@@ -107,100 +44,71 @@ def make_judgments(csv_file, file_path):
     # Make all uses judgments ints
     transformed.label = transformed.label.apply(int)
 
-    # write subsets of dataframe to corresponding lemma folder
-    for lemma in list(set(transformed['lemma'].to_list())):
-        # filter by lemma
-        filtered_df = transformed[transformed['lemma'] == lemma]
-        # drop lemma column
-        filtered_df = filtered_df.drop('lemma', axis=1)
-        # write judgments.tsv file to lemma folder
-        output_dir = os.path.join(file_path, lemma, 'judgments.tsv')
-        filtered_df.to_csv(output_dir, sep='\t', quoting=csv.QUOTE_NONE, index=False)
+    return transformed
 
 #******************************************************#
 # SENSES
 def extract_senses(path):
     fn = path
-    senses = {}
+    lemmas = {}
     with open(fn, 'r') as f:
         reader = csv.DictReader(f, delimiter=',')
         for row in reader:
-            senses[row['sense_id']] = {
-                'senseID': row['sense_id'],
-                'definition': wn.lemma_from_key(row['sense_id']).synset().definition(),
-                'lemma': row['lemma']
-                }
+            lemmas[row['sense_id']] = row['lemma']
+    # resolve every sense key once, definitions of earlier runs are read from the cache
+    definitions = resolve_definitions(lemmas)
+    senses = {}
+    for sense_id, lemma in lemmas.items():
+        senses[sense_id] = {
+            'senseID': sense_id,
+            'definition': definitions[sense_id],
+            'lemma': lemma
+            }
     return senses
 
-def make_senses(csv_file, file_path):
-    nltk.download('omw-1.4')
+def make_senses(csv_file):
     senses = extract_senses(csv_file)
-    transformed = pd.DataFrame(senses.values())
-    for lemma in list(set(transformed['lemma'].to_list())):
-        # filter by lemma
-        filtered_df = transformed[transformed['lemma'] == lemma]
-        # write senses.tsv file to lemma folder
-        output_dir = os.path.join(file_path, lemma, 'senses.tsv')
-        filtered_df.to_csv(output_dir, sep='\t', quoting=csv.QUOTE_NONE, index=False)
+    return pd.DataFrame(senses.values())
 
 
 #*****************************************************************************
 # INSTANCES
 
-def make_instances(path):
+def make_instances(judgments):
     label_set = '5,4,3,2,1'
-    cols = ['instanceID', 'dataIDs', 'label_set', 'non_label']
-    for dir in os.listdir(path):
-        f = os.path.join(path, dir)
-        df = pd.read_csv(os.path.join(f, 'judgments.tsv'), sep='\t', quoting=csv.QUOTE_NONE)
-
-        # get data for instance df
-        instance_ids = df['instanceID'].to_list()
-        non_label = ['-' for i in range(len(instance_ids))]
-        labels = [label_set for i in range(len(instance_ids))]
-        data_ids = []
-        for inst in instance_ids:
-            inst_lst = inst.split('-')
-            data_ids.append(inst_lst[0] + ',' + inst_lst[1])
-
-        new_df = pd.DataFrame(list(zip(instance_ids, data_ids, labels, non_label)), columns=cols)
-        new_df = new_df.drop_duplicates(subset=['instanceID'])
-        new_df.to_csv(os.path.join(f, 'instances.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-
-#####################################################################################################################
-# Concat data to single files
-def concat_mc(path):
-    uses = pd.DataFrame()
-    instances = pd.DataFrame()
-    judgments = pd.DataFrame()
-    senses = pd.DataFrame()
-
-    for dir in os.listdir(path):
-        f = os.path.join(path, dir)
-
-        # Get paths to datafiles
-        use_path = os.path.join(f, 'uses.tsv')
-        inst_path = os.path.join(f, 'instances.tsv')
-        judge_path = os.path.join(f, 'judgments.tsv')
-        sense_path = os.path.join(f, 'senses.tsv')
-
-        # Create dataframes from paths
-        use_frame = pd.read_csv(use_path, delimiter='\t', quoting=csv.QUOTE_NONE)
-        inst_frame = pd.read_csv(inst_path, delimiter='\t', quoting=csv.QUOTE_NONE)
-        judge_frame = pd.read_csv(judge_path, delimiter='\t', quoting=csv.QUOTE_NONE)
-        sense_frame = pd.read_csv(sense_path, delimiter='\t', quoting=csv.QUOTE_NONE)
-
-        # Concat frames
-        uses = pd.concat([uses, use_frame])
-        instances = pd.concat([instances, inst_frame])
-        judgments = pd.concat([judgments, judge_frame])
-        senses = pd.concat([senses, sense_frame])
-    
-    uses.to_csv(os.path.join(path, 'uses.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-    instances.to_csv(os.path.join(path, 'instances.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-    judgments.to_csv(os.path.join(path, 'judgments.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
-    senses.to_csv(os.path.join(path, 'senses.tsv'), sep='\t', quoting=csv.QUOTE_NONE, index=False)
+    # one instance per judged instance id of each lemma
+    instances = judgments[['instanceID', 'lemma']].drop_duplicates()
+    # the instance ids are '<use id>-<sense id>'
+    ids = instances['instanceID'].str.split('-')
+    data_ids = ids.str[0] + ',' + ids.str[1]
+    return pd.DataFrame({'instanceID': instances['instanceID'], 'dataIDs': data_ids, 'label_set': label_set,
+                         'non_label': '-', 'lemma': instances['lemma']})
+
+
+#******************************************************#
+# TRANSFORM
+'''
+Builds the WSSIM tables in memory from the parsed uses and the judgments csv file. The instances are derived
+from the judgments table, nothing is read back from disk.
+
+INPUT: (pandas.DataFrame, str), the parsed uses and the directory of the extracted cl-meaningincontext data.
+OUTPUT: (dict), the uses, judgments, senses and instances tables, each with a lemma column.
+'''
+def make_tables(uses, original_data):
+    # path to judgments csv
+    judge_csv = os.path.join(original_data, JUDGMENTS_CSV)
+    # transform judgments
+    judgments = make_judgments(judge_csv)
+    return {
+        'uses': uses,
+        'judgments': judgments,
+        'senses': make_senses(judge_csv),
+        'instances': make_instances(judgments),
+    }
 
+def transform(uses, original_data, start_path, index=False, parquet=False, context_store=None):
+    # write all tables once, only lemmas whose data changed since the last run are written to their folders
+    write_tables(make_tables(uses, original_data), start_path, CONVERTER_VERSION, index, parquet, context_store)
 
 
 #*****************************************************************************
@@ -210,27 +118,19 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('data_to_format', metavar='data_to_format', type=str, help='directory to download cl-meaningincontext data')
     parser.add_argument('start_directory', metavar='start_directory', type=str, help='Enter directory to download transformed data')
+    parser.add_argument('--index', action='store_true', help='Write a per-lemma row-offset index next to the concatenated files')
+    parser.add_argument('--parquet', action='store_true', help='Also write a Parquet copy of every .tsv file (requires pyarrow)')
+    parser.add_argument('--context-store', type=str, default=None, help='Store the contexts once in a context store in this directory and reference them from uses.tsv')
     args = parser.parse_args()
     original_data = args.data_to_format
     start_path = args.start_directory
 
     # download cl-meaninngincontext data
-    get_mc_data('http://www.dianamccarthy.co.uk/downloads/WordMeaningAnno2012/cl-meaningincontext.tgz', original_data)
-
-    # transform uses
-    xml_file = os.path.join(original_data, 'Data/lexsub_wcdata.xml')
-    make_uses(xml_file, start_path)
-    # path to judgments csv
-    judge_csv = os.path.join(original_data, 'Markup/WordSenseSimilarity/wssim2ratings.csv')
-    # transform judgments
-    make_judgments(judge_csv, start_path)
-    # make senses
-    make_senses(judge_csv, start_path)
-    # make instances
-    make_instances(start_path)
-    # concat data
-    concat_mc(start_path)
+    get_mc_data(MC_URL, original_data)
 
+    # parse uses
+    uses = parse_uses(os.path.join(original_data, XML_FILE))
+    transform(uses, original_data, start_path, args.index, args.parquet, context_store=args.context_store)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,171 @@
+import os
+import sys
+import csv
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog import catalog_lemmas
+from compressed import atomic_writer, exists
+from table_io import read_table
+from usage_graph import AGGREGATES, aggregate_edges, read_pairs
+from cluster_graph import CLUSTERS_NAME
+
+# The year in a DWUG dataID, e.g. 1849 in fic_1849_7166.txt-1090-27
+PERIOD_PATTERN = r'_(\d{4})_'
+
+SCORES = ['jsd', 'compare']
+
+#*****************************************************************************
+# PERIODS
+
+'''
+Assigns uses to the two periods by the year in their dataID: uses before the split year belong to period 0, the
+others to period 1. Uses without a year get period -1 and are left out of the scores.
+
+INPUT: (numpy.ndarray, int, str), the dataIDs, the split year and a regular expression whose first group is the year.
+OUTPUT: (numpy.ndarray), the period of every use.
+'''
+def use_periods(data_ids, split, pattern=PERIOD_PATTERN):
+    years = pd.to_numeric(pd.Series(data_ids, dtype=str).str.extract(pattern, expand=False), errors='coerce').to_numpy()
+    return np.where(np.isnan(years), -1, (years >= split).astype(np.int64))
+
+#*****************************************************************************
+# SCORES
+
+'''
+Computes COMPARE, the mean aggregated judgment of the judged pairs of uses from different periods, for all lemmas
+at once. The uses of all lemmas are coded in one range, so the edges of all lemmas are aggregated in one pass and
+averaged per lemma with one bincount.
+
+INPUT: (list, int, str, str), the lemma folders, the split year, the aggregate of the judgments of a pair and the
+pattern of the years.
+OUTPUT: (numpy.ndarray, numpy.ndarray, numpy.ndarray, list), COMPARE (NaN for lemmas without cross-period pairs), the
+number of cross-period pairs, the number of uses of each period (one row per lemma) and the dataIDs of the uses of
+every lemma with at least one judged pair.
+'''
+def compare_scores(folders, split, aggregate='median', pattern=PERIOD_PATTERN):
+    if not folders:
+        return np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros((0, 2), dtype=np.int64), []
+    nodes, firsts, seconds, labels, lemma_of = [], [], [], [], []
+    offset = 0
+    for i, folder in enumerate(folders):
+        data_ids, first, second, judgments = read_pairs(folder)
+        nodes.append(data_ids)
+        firsts.append(first + offset)
+        seconds.append(second + offset)
+        labels.append(judgments)
+        lemma_of.append(np.full(len(data_ids), i))
+        offset += len(data_ids)
+
+    lemma_of, nodes = np.concatenate(lemma_of), np.concatenate(nodes)
+    periods = use_periods(nodes, split, pattern)
+    rows, cols, weights, counts = aggregate_edges(offset, np.concatenate(firsts), np.concatenate(seconds),
+                                                  np.concatenate(labels), aggregate)
+    cross = (periods[rows] >= 0) & (periods[cols] >= 0) & (periods[rows] != periods[cols])
+    pairs = np.bincount(lemma_of[rows[cross]], minlength=len(folders))
+    sums = np.bincount(lemma_of[rows[cross]], weights=weights[cross], minlength=len(folders))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        compare = sums / pairs
+    sizes = np.zeros((len(folders), 2), dtype=np.int64)
+    np.add.at(sizes, (lemma_of[periods >= 0], periods[periods >= 0]), 1)
+
+    # uses with a judged pair with another use, self-pairs do not connect a use to the graph
+    linked = np.zeros(offset, dtype=bool)
+    loops = rows == cols
+    linked[rows[~loops]] = linked[cols[~loops]] = True
+    judged = np.split(nodes[linked], np.searchsorted(lemma_of[linked], np.arange(1, len(folders))))
+    return compare, pairs, sizes, judged
+
+'''
+Computes the Jensen-Shannon divergence (base 2, between 0 and 1) between the cluster distributions of the two
+periods for all lemmas at once, from a matrix of cluster counts per lemma and period. Uses without a judged pair
+are left out if the judged uses are given: the clustering puts each of them in a cluster of its own, which would
+count as a sense found in only one period.
+
+INPUT: (list, int, str, list), the clusters.tsv files of the lemmas (None for lemmas without clusters), the split
+year, the pattern of the years and optionally the dataIDs of the judged uses of every lemma.
+OUTPUT: (numpy.ndarray), the divergence of every lemma, NaN if a period has no clustered uses.
+'''
+def jsd_scores(cluster_files, split, pattern=PERIOD_PATTERN, judged=None):
+    lemma_of, periods, clusters = [], [], []
+    for i, path in enumerate(cluster_files):
+        if path is None:
+            continue
+        df = read_table(path, columns=['dataID', 'cluster'])
+        if judged is not None:
+            df = df[df['dataID'].isin(judged[i])]
+        lemma_of.append(np.full(len(df), i))
+        periods.append(use_periods(df['dataID'].to_numpy(), split, pattern))
+        clusters.append(df['cluster'].astype(np.int64).to_numpy())
+    if not clusters:
+        return np.full(len(cluster_files), np.nan)
+
+    lemma_of, periods, clusters = map(np.concatenate, (lemma_of, periods, clusters))
+    dated = periods >= 0
+    counts = np.zeros((len(cluster_files), 2, clusters.max() + 1 if len(clusters) else 1))
+    np.add.at(counts, (lemma_of[dated], periods[dated], clusters[dated]), 1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p = counts / counts.sum(axis=2, keepdims=True)
+        m = p.mean(axis=1, keepdims=True)
+        terms = np.where(p > 0, p * np.log2(p / m), 0.0)
+    jsd = terms.sum(axis=2).mean(axis=1)
+    empty = (counts.sum(axis=2) == 0).any(axis=1)
+    return np.where(empty, np.nan, np.clip(jsd, 0.0, 1.0))
+
+'''
+Scores the semantic change of every lemma folder of a data directory between the two periods: JSD of the cluster
+distributions (if a clusters directory written by cluster_graph.py is given) and COMPARE of the judgments. The
+graded change is JSD or the negated COMPARE, so that a higher score always means more change.
+
+INPUT: (str, int, str, str, str, str), a path to the data directory, the split year, the clusters directory (or
+None), the score used as graded change, the aggregate of the judgments of a pair and the pattern of the years.
+OUTPUT: (pandas.DataFrame), the scores of every lemma.
+'''
+def score_tree(path, split, clusters_path=None, score='jsd', aggregate='median', pattern=PERIOD_PATTERN):
+    lemmas = [lemma for lemma in catalog_lemmas(path)
+              if all(exists(os.path.join(path, lemma, name)) for name in ['uses.tsv', 'instances.tsv', 'judgments.tsv'])]
+    folders = [os.path.join(path, lemma) for lemma in lemmas]
+    compare, pairs, sizes, judged = compare_scores(folders, split, aggregate, pattern)
+
+    cluster_files = [None] * len(lemmas)
+    if clusters_path is not None:
+        cluster_files = [os.path.join(clusters_path, lemma, CLUSTERS_NAME) for lemma in lemmas]
+        cluster_files = [file if exists(file) else None for file in cluster_files]
+    jsd = jsd_scores(cluster_files, split, pattern, judged)
+
+    return pd.DataFrame({'lemma': lemmas, 'change_graded': jsd if score == 'jsd' else -compare, 'jsd': jsd,
+                         'compare': compare, 'uses1': sizes[:, 0], 'uses2': sizes[:, 1], 'pairs': pairs})
+
+
+#*****************************************************************************
+# MAIN
+
+def main():
+    parser = argparse.ArgumentParser(description='Score the semantic change of every lemma of a data directory between two time periods, from its clusters (JSD) and its use pair judgments (COMPARE).')
+    parser.add_argument('data_directory', metavar='data_directory', type=str, help='Directory containing one folder per lemma (e.g. dwug_en/data)')
+    parser.add_argument('output_file', metavar='output_file', type=str, help='The .tsv file to write the scores to (e.g. graded_change.tsv)')
+    parser.add_argument('--split', type=int, required=True, help='First year of the second period, e.g. 1900 for 1810-1860 and 1960-2010')
+    parser.add_argument('--pattern', type=str, default=PERIOD_PATTERN, help='Regular expression whose first group extracts the year from a dataID (default: %(default)s)')
+    parser.add_argument('--clusters', type=str, default=None, help='Directory written by cluster_graph.py, with one folder per lemma containing its clusters.tsv (required for JSD)')
+    parser.add_argument('--score', choices=SCORES, default=None, help='Score written as change_graded: jsd or the negated compare (default: jsd if --clusters is given, compare otherwise)')
+    parser.add_argument('--aggregate', choices=AGGREGATES, default='median', help='How the judgments of a pair of uses are aggregated for COMPARE (default: %(default)s)')
+    args = parser.parse_args()
+
+    score = args.score or ('jsd' if args.clusters else 'compare')
+    if score == 'jsd' and args.clusters is None:
+        parser.error('--score jsd requires --clusters')
+
+    start = time.perf_counter()
+    df = score_tree(args.data_directory, args.split, args.clusters, score, args.aggregate, args.pattern)
+    with atomic_writer(args.output_file, compression='') as f:
+        f.write(df.to_csv(sep='\t', quoting=csv.QUOTE_NONE, index=False).encode('utf-8'))
+    print(f'scored {len(df)} lemmas in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog import plan_lemmas
+from compressed import atomic_writer, exists
+from usage_graph import AGGREGATES, build_graph
+
+CLUSTERS_NAME = 'clusters.tsv'
+
+# Moves must improve the objective by more than this, so rounding errors do not make nodes move back and forth
+EPSILON = 1e-4
+
+#*****************************************************************************
+# CORRELATION CLUSTERING
+
+'''
+Turns the edge weights of a usage graph into the signed weights of correlation clustering: edges above the threshold
+pull their uses into the same cluster, edges below it push them apart, by the distance of the weight from the
+threshold. Self-loops are dropped.
+
+INPUT: (scipy.sparse.csr_matrix, float), the weights and the threshold (e.g. 2.5 for the DURel scale).
+OUTPUT: (scipy.sparse.csr_matrix), the signed weights.
+'''
+def signed_graph(weights, threshold):
+    coo = weights.tocoo()
+    keep = coo.row != coo.col
+    return sparse.csr_matrix((coo.data[keep] - threshold, (coo.row[keep], coo.col[keep])), shape=weights.shape)
+
+'''
+Computes the loss of a clustering: the signed weights of the positive edges between clusters plus the absolute
+signed weights of the negative edges within clusters.
+
+INPUT: (scipy.sparse.csr_matrix, numpy.ndarray), the signed weights and the cluster of every node.
+OUTPUT: (float), the loss.
+'''
+def clustering_loss(signed, labels):
+    coo = signed.tocoo()
+    same = labels[coo.row] == labels[coo.col]
+    # every edge is stored in both directions
+    return (coo.data[~same & (coo.data > 0)].sum() - coo.data[same & (coo.data < 0)].sum()) / 2
+
+'''
+Improves a clustering by local search: every node in turn is moved to the cluster it is most attracted to, or to
+an empty cluster of its own if it is repelled by all clusters next to it. sums[v] maps the clusters next to node v
+to the signed weight between v and their nodes, so the gain of every move of a node is read from its own entries,
+and a move only updates the entries of the neighbours of the moved node instead of recomputing the objective. The
+sums take memory in the number of edges, not in the square of the number of nodes. The size of every cluster is
+counted, so a node is only ever moved to a cluster without nodes, never to a cluster of unrelated nodes. Ties go to
+the cluster with the smallest id, and the sweeps end when no node moves.
+
+INPUT: (scipy.sparse.csr_matrix, numpy.ndarray, numpy.random.Generator, int), the signed weights, the initial
+cluster of every node (changed in place, cluster ids below the number of nodes), the random generator for the
+order of the nodes and the maximum number of sweeps.
+OUTPUT: (numpy.ndarray), the clusters.
+'''
+def local_search(signed, labels, rng, max_sweeps=100):
+    n = signed.shape[0]
+    indptr = signed.indptr.tolist()
+    indices = signed.indices.tolist()
+    data = signed.data.tolist()
+    current_labels = labels.tolist()
+    sums = [{} for _ in range(n)]
+    for v in range(n):
+        row = sums[v]
+        for u, w in zip(indices[indptr[v]:indptr[v + 1]], data[indptr[v]:indptr[v + 1]]):
+            row[current_labels[u]] = row.get(current_labels[u], 0.0) + w
+    sizes = np.bincount(labels, minlength=n).tolist()
+    # the ids of the empty clusters, taken from the end
+    empty = [k for k in range(n - 1, -1, -1) if sizes[k] == 0]
+
+    nodes = np.flatnonzero(np.diff(signed.indptr))
+    for sweep in range(max_sweeps):
+        moved = False
+        for v in rng.permutation(nodes).tolist():
+            row = sums[v]
+            current = current_labels[v]
+            best, value = min(row.items(), key=lambda item: (-item[1], item[0]), default=(None, 0.0))
+            alone = best is None or value < 0
+            if alone:
+                # a cluster of its own is worth 0, unless the node is alone already
+                if not empty or sizes[current] == 1:
+                    continue
+                best, value = empty[-1], 0.0
+            if value - row.get(current, 0.0) <= EPSILON:
+                continue
+            if alone:
+                empty.pop()
+            for u, w in zip(indices[indptr[v]:indptr[v + 1]], data[indptr[v]:indptr[v + 1]]):
+                neighbour = sums[u]
+                left = neighbour.get(current, 0.0) - w
+                if left == 0.0:
+                    neighbour.pop(current, None)
+                else:
+                    neighbour[current] = left
+                neighbour[best] = neighbour.get(best, 0.0) + w
+            sizes[current] -= 1
+            sizes[best] += 1
+            if sizes[current] == 0:
+                empty.append(current)
+            current_labels[v] = best
+            moved = True
+        if not moved:
+            break
+    labels[:] = current_labels
+    return labels
+
+'''
+Runs local search from several random initial clusterings and keeps the best one. Every restart has its own
+generator seeded with (seed, restart), so the result does not depend on how the restarts are spread over processes.
+Restart 0 starts from singletons, the others from a random number of random clusters.
+
+INPUT: (scipy.sparse.csr_matrix, list, int, int), the signed weights, the numbers of the restarts, the seed and the
+maximum number of sweeps.
+OUTPUT: (float, int, numpy.ndarray), the loss, the restart and the clusters of the best clustering.
+'''
+def run_restarts(signed, restarts, seed=0, max_sweeps=100):
+    n = signed.shape[0]
+    best = None
+    for restart in restarts:
+        rng = np.random.default_rng([seed, restart])
+        if restart == 0:
+            labels = np.arange(n)
+        else:
+            labels = rng.integers(0, rng.integers(1, n + 1), size=n)
+        labels = local_search(signed, labels, rng, max_sweeps)
+        result = (clustering_loss(signed, labels), restart, labels)
+        if best is None or result[:2] < best[:2]:
+            best = result
+    return best
+
+'''
+Numbers the clusters by size, largest first (ties by their first node). Every cluster is split into its connected
+components first, as uses without a path of judged edges between them have no evidence of the same sense; this
+does not change the loss. Nodes without signed edges, e.g. uses that were never judged, get a cluster of their own.
+
+INPUT: (scipy.sparse.csr_matrix, numpy.ndarray), the signed weights and the cluster of every node.
+OUTPUT: (numpy.ndarray), the cluster numbers.
+'''
+def canonical_clusters(signed, labels):
+    coo = signed.tocoo()
+    within = labels[coo.row] == labels[coo.col]
+    inner = sparse.csr_matrix((np.ones(within.sum()), (coo.row[within], coo.col[within])), shape=signed.shape)
+    labels = csgraph.connected_components(inner, directed=False)[1]
+    ids, first, inverse, counts = np.unique(labels, return_index=True, return_inverse=True, return_counts=True)
+    order = np.lexsort((first, -counts))
+    rank = np.empty(len(ids), dtype=np.int64)
+    rank[order] = np.arange(len(ids))
+    return rank[inverse]
+
+#*****************************************************************************
+# CLUSTER THE LEMMAS
+
+# The graph of the lemma a process works on, so that it is built once per process and not sent with every chunk
+_graph = {}
+
+def _lemma_graph(folder, threshold, aggregate):
+    key = (folder, threshold, aggregate)
+    if key not in _graph:
+        _graph.clear()
+        weights, judgments, nodes = build_graph(folder, aggregate)
+        _graph[key] = (signed_graph(weights, threshold), nodes)
+    return _graph[key]
+
+def _run_restarts(args):
+    folder, threshold, aggregate, restarts, seed, max_sweeps = args
+    signed, nodes = _lemma_graph(folder, threshold, aggregate)
+    return run_restarts(signed, restarts, seed, max_sweeps)
+
+'''
+Writes the clusters of a lemma as a .tsv file with the dataID and the cluster of every use.
+
+INPUT: (str, numpy.ndarray, numpy.ndarray), the path of the file, the dataIDs and their clusters.
+OUTPUT: (None)
+'''
+def write_clusters(path, nodes, clusters):
+    df = pd.DataFrame({'dataID': nodes, 'cluster': clusters})
+    with atomic_writer(path) as f:
+        f.write(df.to_csv(sep='\t', quoting=csv.QUOTE_NONE, index=False).encode('utf-8'))
+
+'''
+Clusters the usage graph of every lemma folder of a data directory and writes the clusters to one folder per lemma
+in the output directory (e.g. clusters/<lemma>/clusters.tsv). The restarts of every lemma are split into one chunk
+per worker process, so the restarts of a large lemma run on all cores; the largest lemmas are submitted first.
+The chunks only name the lemma folder, and every process builds the graph of a lemma once for all its chunks.
+
+INPUT: (str, str, float, str, int, int, int, int), a path to the data directory, the output directory, the
+threshold, the aggregate of the edge weights, the number of restarts, the maximum number of sweeps, the seed and
+the number of worker processes.
+OUTPUT: (dict), the number of clusters and the loss of every clustered lemma.
+'''
+def cluster_tree(path, out_path, threshold=2.5, aggregate='median', restarts=20, max_sweeps=100, seed=0, jobs=1):
+    folders = {}
+    for lemma, size in plan_lemmas(path, ['judgments.tsv']):
+        folder = os.path.join(path, lemma)
+        if all(exists(os.path.join(folder, name)) for name in ['uses.tsv', 'instances.tsv', 'judgments.tsv']):
+            folders[lemma] = folder
+
+    chunks = np.array_split(np.arange(restarts), max(min(jobs, restarts), 1))
+    tasks = [(lemma, (folder, threshold, aggregate, chunk.tolist(), seed, max_sweeps))
+             for lemma, folder in folders.items() for chunk in chunks if len(chunk)]
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_run_restarts, [args for lemma, args in tasks], chunksize=1))
+    else:
+        results = [_run_restarts(args) for lemma, args in tasks]
+
+    best = {}
+    for (lemma, args), result in zip(tasks, results):
+        if lemma not in best or result[:2] < best[lemma][:2]:
+            best[lemma] = result
+
+    stats = {}
+    for lemma, (loss, restart, labels) in best.items():
+        signed, nodes = _lemma_graph(folders[lemma], threshold, aggregate)
+        clusters = canonical_clusters(signed, labels)
+        os.makedirs(os.path.join(out_path, lemma), exist_ok=True)
+        write_clusters(os.path.join(out_path, lemma, CLUSTERS_NAME), nodes, clusters)
+        stats[lemma] = (int(clusters.max()) + 1 if len(clusters) else 0, loss)
+    return stats
+
+
+#*****************************************************************************
+# MAIN
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster the usage graph of every lemma of a data directory by correlation clustering and write the clusters of its uses.')
+    parser.add_argument('data_directory', metavar='data_directory', type=str, help='Directory containing one folder per lemma (e.g. dwug_en/data)')
+    parser.add_argument('output_directory', metavar='output_directory', type=str, help=f'Directory to write one folder per lemma with its {CLUSTERS_NAME} to')
+    parser.add_argument('--threshold', type=float, default=2.5, help='Edge weights above the threshold join two uses, weights below it separate them (default: %(default)s)')
+    parser.add_argument('--aggregate', choices=AGGREGATES, default='median', help='How the judgments of a pair of uses are aggregated into the edge weight (default: %(default)s)')
+    parser.add_argument('--restarts', type=int, default=20, help='Number of local searches from random clusterings per lemma (default: %(default)s)')
+    parser.add_argument('--max-sweeps', type=int, default=100, help='Maximum number of passes over the uses per local search (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random clusterings (default: %(default)s)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='Number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = cluster_tree(args.data_directory, args.output_directory, args.threshold, args.aggregate,
+                         args.restarts, args.max_sweeps, args.seed, args.jobs)
+    for lemma, (clusters, loss) in sorted(stats.items()):
+        print(f'{lemma}: {clusters} clusters, loss {loss:g}')
+    print(f'clustered {len(stats)} lemmas in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import os
+import sys
+import time
+import zlib
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog import catalog_lemmas, read_catalog, write_catalog
+from compressed import atomic_writer, exists
+from table_io import copy_table, read_table
+from tsv_concat import concat_tree, index_path
+from change_scores import PERIOD_PATTERN, use_periods
+
+MODES = ['random', 'within', 'cross']
+
+# The label set and non-label of DWUG use pair instances, as written by convert_dwug.py
+LABEL_SET = '1,2,3,4'
+NON_LABEL = '-'
+
+# Number of pair indices permuted and decoded at once
+BLOCK_SIZE = 1 << 16
+
+# Rounds of the Feistel network; four rounds make a pseudorandom permutation
+ROUNDS = 4
+
+#*****************************************************************************
+# PERMUTATION
+
+def _mix(x):
+    # the splitmix64 finaliser, numpy uint64 arithmetic wraps around
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+'''
+Permutes the integers 0 ... size - 1 in a pseudorandom order without materializing them. A Feistel network is a
+bijection on the integers of 2 * half bits, the smallest even number of bits that covers the size; outputs of
+size or more are skipped, which visits every integer below size exactly once (the vectorized form of cycle
+walking). The order is yielded in blocks, so memory stays constant in the size.
+
+INPUT: (int, int, int), the number of integers, the seed and the block size.
+OUTPUT: (iterator), numpy uint64 arrays with the next integers of the permutation.
+'''
+def permuted_blocks(size, seed=0, block_size=BLOCK_SIZE):
+    if size <= 0:
+        return
+    bits = max(2, (size - 1).bit_length())
+    half = (bits + 1) // 2
+    mask = np.uint64((1 << half) - 1)
+    keys = np.random.default_rng(seed).integers(0, 1 << 63, size=ROUNDS, dtype=np.uint64)
+    for start in range(0, 1 << (2 * half), block_size):
+        x = np.arange(start, min(start + block_size, 1 << (2 * half)), dtype=np.uint64)
+        left, right = x >> np.uint64(half), x & mask
+        for key in keys:
+            left, right = right, left ^ (_mix(right ^ key) & mask)
+        x = (left << np.uint64(half)) | right
+        yield x[x < np.uint64(size)]
+
+'''
+Decodes pair indices into the pairs (i, j), i < j, of n items. The pairs are numbered column by column of the
+upper triangle, so pair k has j = floor((1 + sqrt(1 + 8k)) / 2) and i = k - j(j - 1) / 2; the float square root
+is corrected by one where it rounds across a column.
+
+INPUT: (numpy.ndarray), the pair indices.
+OUTPUT: (numpy.ndarray, numpy.ndarray), i and j of every pair.
+'''
+def decode_pairs(k):
+    k = k.astype(np.int64)
+    j = ((1 + np.sqrt(1 + 8 * k.astype(np.float64))) // 2).astype(np.int64)
+    j -= j * (j - 1) // 2 > k
+    j += (j + 1) * j // 2 <= k
+    return k - j * (j - 1) // 2, j
+
+#*****************************************************************************
+# SAMPLE THE PAIRS
+
+'''
+Draws pairs of uses without replacement in a random order, straight from the index arithmetic of the pairs, so the
+n² candidate pairs are never enumerated in memory. In the 'random' mode, all pairs of uses are candidates; in
+'within' mode, pairs of uses of the same period; in 'cross' mode, pairs of a use of the first and a use of the
+second period. With a budget, pairs with a use that already is in budget pairs are skipped.
+
+INPUT: (numpy.ndarray, str, numpy.ndarray, int, int, int), the dataIDs, the mode, the period of every use (needed
+for 'within' and 'cross'), the maximum number of pairs (None for all), the maximum number of pairs per use (None
+for no limit) and the seed.
+OUTPUT: (iterator), (first, second) arrays of use positions per block of pairs.
+'''
+def sample_pairs(data_ids, mode='random', periods=None, max_pairs=None, budget=None, seed=0):
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}', choose from {', '.join(MODES)}.")
+    if mode == 'random':
+        groups = [np.arange(len(data_ids))]
+    else:
+        if periods is None:
+            raise ValueError(f"The '{mode}' mode needs the period of every use.")
+        groups = [np.flatnonzero(periods == period) for period in (0, 1)]
+
+    if mode == 'cross':
+        size = len(groups[0]) * len(groups[1])
+    else:
+        sizes = np.array([len(group) * (len(group) - 1) // 2 for group in groups], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        members = np.concatenate(groups)
+        starts = np.concatenate(([0], np.cumsum([len(group) for group in groups])))
+        size = int(offsets[-1])
+
+    counts = np.zeros(len(data_ids), dtype=np.int64)
+    drawn = 0
+    for k in permuted_blocks(size, seed):
+        if mode == 'cross':
+            first = groups[0][k // np.uint64(len(groups[1]))]
+            second = groups[1][k % np.uint64(len(groups[1]))]
+        else:
+            k = k.astype(np.int64)
+            group = np.searchsorted(offsets, k, side='right') - 1
+            i, j = decode_pairs(k - offsets[group])
+            first = members[starts[group] + i]
+            second = members[starts[group] + j]
+
+        if budget is not None:
+            # drop the pairs of uses that are already used up at once, then take the rest one by one, as the pairs
+            # of a block depend on each other through the counts
+            open_pairs = (counts[first] < budget) & (counts[second] < budget)
+            first, second = first[open_pairs], second[open_pairs]
+            keep = np.zeros(len(first), dtype=bool)
+            for n, (a, b) in enumerate(zip(first.tolist(), second.tolist())):
+                if counts[a] < budget and counts[b] < budget:
+                    counts[a] += 1
+                    counts[b] += 1
+                    keep[n] = True
+            first, second = first[keep], second[keep]
+
+        if max_pairs is not None:
+            first, second = first[:max_pairs - drawn], second[:max_pairs - drawn]
+        drawn += len(first)
+        if len(first):
+            yield first, second
+        if drawn == max_pairs or budget is not None and (counts < budget).sum() < 2:
+            return
+
+'''
+Streams sampled pairs of uses to an instances.tsv file in the use pair schema read by the AnnotationProvider
+(instanceID, dataIDs, label_set, non_label). Rows are written block by block, so memory does not grow with the
+number of pairs.
+
+INPUT: (str, numpy.ndarray, iterator, str, str, str), the path of the instances.tsv file, the dataIDs, the blocks of
+pairs from sample_pairs(), the lemma (for the instanceIDs), the label set and the non-label.
+OUTPUT: (int), the number of written instances.
+'''
+def write_instances(path, data_ids, pairs, lemma, label_set=LABEL_SET, non_label=NON_LABEL):
+    written = 0
+    with atomic_writer(path) as f:
+        f.write(b'instanceID\tdataIDs\tlabel_set\tnon_label\n')
+        for first, second in pairs:
+            suffix = f'\t{label_set}\t{non_label}\n'
+            rows = [f'{written + n}_{lemma}\t{a},{b}{suffix}'
+                    for n, (a, b) in enumerate(zip(data_ids[first].tolist(), data_ids[second].tolist()))]
+            f.write(''.join(rows).encode('utf-8'))
+            written += len(rows)
+    return written
+
+'''
+Samples the use pair instances of every lemma folder of a data directory (or of a single lemma folder) and writes
+them to one folder per lemma in the output directory, together with a copy of its uses.tsv, so that the folder can
+be annotated with the AnnotationProvider. Every lemma gets its own seed derived from the seed and its name, so the
+pairs of a lemma do not depend on the other lemmas. The instanceIDs are numbered from 0 for every
+lemma, so instances are never written to a folder that has a judgments.tsv: its judgments would refer to the new
+pairs. A combined instances.tsv of the output directory is rebuilt from the lemma files.
+
+INPUT: (str, str, str, int, int, int, int, str, bool), a path to the data directory, the output directory, the mode,
+the maximum number of pairs and pairs per use of every lemma, the seed, the split year and the pattern of the
+periods, and whether to overwrite existing instances.tsv files.
+OUTPUT: (dict), the number of instances of every lemma.
+'''
+def sample_tree(path, out_path, mode='random', max_pairs=None, budget=None, seed=0, split=None,
+                pattern=PERIOD_PATTERN, force=False):
+    single = exists(os.path.join(path, 'uses.tsv')) and not any(
+        os.path.isdir(os.path.join(path, d)) for d in os.listdir(path))
+    if single:
+        folders = {os.path.basename(os.path.normpath(path)): (path, out_path)}
+    else:
+        folders = {lemma: (os.path.join(path, lemma), os.path.join(out_path, lemma)) for lemma in catalog_lemmas(path)}
+    folders = {lemma: folder for lemma, folder in sorted(folders.items()) if exists(os.path.join(folder[0], 'uses.tsv'))}
+
+    # check all lemmas before writing any of them
+    for lemma, (folder, out_folder) in folders.items():
+        out_file = os.path.join(out_folder, 'instances.tsv')
+        if exists(os.path.join(out_folder, 'judgments.tsv')):
+            raise FileExistsError(f"'{out_folder}' has judgments of its instances, which would refer to the new pairs. "
+                                  'Write the new round to another directory.')
+        if exists(out_file) and not force:
+            raise FileExistsError(f"'{out_file}' already exists, use --force to overwrite it.")
+
+    results = {}
+    for lemma, (folder, out_folder) in folders.items():
+        data_ids = read_table(os.path.join(folder, 'uses.tsv'), columns=['dataID'])['dataID'].to_numpy(dtype=str)
+        periods = use_periods(data_ids, split, pattern) if mode != 'random' else None
+        pairs = sample_pairs(data_ids, mode, periods, max_pairs, budget, [seed, zlib.crc32(lemma.encode('utf-8'))])
+        os.makedirs(out_folder, exist_ok=True)
+        results[lemma] = write_instances(os.path.join(out_folder, 'instances.tsv'), data_ids, pairs, lemma)
+        # the AnnotationProvider reads the uses next to the instances
+        if os.path.abspath(out_folder) != os.path.abspath(folder):
+            copy_table(os.path.join(folder, 'uses.tsv'), os.path.join(out_folder, 'uses.tsv'))
+
+    # keep the catalog and the combined instances.tsv of an output directory that has them (e.g. when sampling in
+    # place) up to date
+    entries = read_catalog(out_path)
+    if entries is not None and results:
+        write_catalog(out_path, list(dict.fromkeys(entry['file'] for entry in entries)), catalog_lemmas(out_path), results)
+    if not single and results and exists(os.path.join(out_path, 'instances.tsv')):
+        lemmas = [lemma for lemma in catalog_lemmas(out_path) if exists(os.path.join(out_path, lemma, 'instances.tsv'))]
+        concat_tree(out_path, ['instances.tsv'], lemmas, os.path.exists(index_path(out_path, 'instances.tsv')))
+    return results
+
+#*****************************************************************************
+# MAIN
+
+def main():
+    parser = argparse.ArgumentParser(description='Sample use pair instances for a new annotation round from the uses.tsv files of a data directory.')
+    parser.add_argument('data_directory', metavar='data_directory', type=str, help='Directory containing one folder per lemma with a uses.tsv file, or a single lemma folder')
+    parser.add_argument('output_directory', metavar='output_directory', type=str, help='Directory to write one folder per lemma with its instances.tsv to (the data directory itself only if it has no judgments yet)')
+    parser.add_argument('--mode', choices=MODES, default='random', help='random: any two uses, within: two uses of the same period, cross: one use of each period (default: %(default)s)')
+    parser.add_argument('--pairs', type=int, default=None, help='Maximum number of pairs per lemma (default: all candidate pairs)')
+    parser.add_argument('--per-use', type=int, default=None, help='Maximum number of pairs a use is part of')
+    parser.add_argument('--split', type=int, default=None, help='First year of the second period, required for the within and cross modes')
+    parser.add_argument('--pattern', type=str, default=PERIOD_PATTERN, help='Regular expression whose first group extracts the year from a dataID (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the pair order (default: %(default)s)')
+    parser.add_argument('--force', action='store_true', help='Overwrite existing instances.tsv files of lemmas without judgments')
+    args = parser.parse_args()
+
+    if args.mode != 'random' and args.split is None:
+        parser.error(f'--mode {args.mode} requires --split')
+
+    start = time.perf_counter()
+    results = sample_tree(args.data_directory, args.output_directory, args.mode, args.pairs, args.per_use,
+                          args.seed, args.split, args.pattern, args.force)
+    print(f'sampled {sum(results.values())} pairs for {len(results)} lemmas in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
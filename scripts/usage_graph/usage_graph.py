@@ -0,0 +1,221 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog import plan_lemmas
+from compressed import atomic_writer, exists
+from table_io import read_table
+
+AGGREGATES = ['median', 'mean']
+FORMATS = ['npz', 'tsv']
+
+# The files written to the folder of every lemma
+GRAPH_NAME = 'graph.npz'
+EDGES_NAME = 'edges.tsv'
+
+#*****************************************************************************
+# BUILD THE GRAPH
+
+'''
+Reads the judgments of a lemma folder as pairs of integer-coded uses: every dataID of uses.tsv is coded by its row
+in uses.tsv. Judgments with the non_label of their instance (e.g. '-' for "cannot decide"), empty or non-numeric
+labels and instances whose dataIDs are not two uses of uses.tsv (e.g. use-sense pairs) are dropped.
+
+INPUT: (str), a path to the lemma folder.
+OUTPUT: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray), the dataIDs in the order of uses.tsv and
+the codes of the two uses and the label of every judgment.
+'''
+def read_pairs(folder):
+    nodes = pd.Index(read_table(os.path.join(folder, 'uses.tsv'), columns=['dataID'])['dataID'])
+    if not nodes.is_unique:
+        raise ValueError(f"Duplicate dataID in '{os.path.join(folder, 'uses.tsv')}'.")
+    instances = read_table(os.path.join(folder, 'instances.tsv'), columns=['instanceID', 'dataIDs', 'non_label'])
+    judgments = read_table(os.path.join(folder, 'judgments.tsv'), columns=['instanceID', 'label'])
+
+    # code both uses of every instance; instances with more than two dataIDs keep a comma in the second part
+    parts = instances['dataIDs'].str.partition(',')
+    first = nodes.get_indexer(parts[0])
+    second = nodes.get_indexer(parts[2])
+
+    instance = pd.Index(instances['instanceID']).get_indexer(judgments['instanceID'])
+    labels = pd.to_numeric(judgments['label'], errors='coerce').to_numpy(dtype=np.float64)
+    # judgments of unknown instances (-1) get an empty non_label and are dropped below
+    non_labels = np.append(instances['non_label'].to_numpy(dtype=object), '')[instance]
+    keep = (instance >= 0) & ~np.isnan(labels) & (judgments['label'].to_numpy() != non_labels)
+    instance = instance[keep]
+    keep_pairs = (first[instance] >= 0) & (second[instance] >= 0)
+    instance = instance[keep_pairs]
+    return nodes.to_numpy(dtype=str), first[instance], second[instance], labels[keep][keep_pairs]
+
+'''
+Aggregates the judgments of every pair of uses into one edge. The graph is undirected, so (a, b) and (b, a) are the
+same edge. The judgments are sorted by edge and label once, so the median of every edge is read off at the middle
+of its run and the mean is a sum over the run, without a Python loop over the edges.
+
+INPUT: (int, numpy.ndarray, numpy.ndarray, numpy.ndarray, str), the number of uses, the codes of the two uses and
+the label of every judgment, and the aggregate ('median' or 'mean').
+OUTPUT: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray), the smaller and larger use code, the weight
+and the number of judgments of every edge.
+'''
+def aggregate_edges(n, first, second, labels, aggregate='median'):
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate '{aggregate}', choose from {', '.join(AGGREGATES)}.")
+    if len(labels) == 0:
+        empty = np.zeros(0, dtype=np.int32)
+        return empty, empty.copy(), np.zeros(0, dtype=np.float64), empty.copy()
+
+    keys = np.minimum(first, second).astype(np.int64) * n + np.maximum(first, second)
+    order = np.lexsort((labels, keys))
+    keys, labels = keys[order], labels[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.concatenate((starts, [len(keys)])))
+    if aggregate == 'median':
+        weights = (labels[starts + (counts - 1) // 2] + labels[starts + counts // 2]) / 2
+    else:
+        weights = np.add.reduceat(labels, starts) / counts
+    edges = keys[starts]
+    return (edges // n).astype(np.int32), (edges % n).astype(np.int32), weights, counts.astype(np.int32)
+
+'''
+Builds the usage graph of a lemma: a weighted, symmetric adjacency matrix over the uses of uses.tsv in CSR format,
+with the aggregated judgment of every judged pair of uses as edge weight. A second matrix with the same structure
+holds the number of judgments of every edge.
+
+INPUT: (str, str), a path to the lemma folder and the aggregate ('median' or 'mean').
+OUTPUT: (scipy.sparse.csr_matrix, scipy.sparse.csr_matrix, numpy.ndarray), the weights, the numbers of judgments
+and the dataID of every row and column.
+'''
+def build_graph(folder, aggregate='median'):
+    nodes, first, second, labels = read_pairs(folder)
+    n = len(nodes)
+    rows, cols, weights, counts = aggregate_edges(n, first, second, labels, aggregate)
+    return _symmetric(rows, cols, weights, n), _symmetric(rows, cols, counts, n), nodes
+
+def _symmetric(rows, cols, values, n):
+    # mirror every edge, self-loops only once
+    mirrored = rows != cols
+    return sparse.csr_matrix((np.concatenate((values, values[mirrored])),
+                              (np.concatenate((rows, cols[mirrored])), np.concatenate((cols, rows[mirrored])))),
+                             shape=(n, n))
+
+#*****************************************************************************
+# EXPORT
+
+'''
+Saves a usage graph in a compressed .npz file: the CSR arrays (int32 indices, float32 weights, int32 numbers of
+judgments) and the dataIDs of the rows and columns.
+
+INPUT: (str, scipy.sparse.csr_matrix, scipy.sparse.csr_matrix, numpy.ndarray, str), the path of the file, the
+weights, the numbers of judgments, the dataIDs and the aggregate of the weights.
+OUTPUT: (None)
+'''
+def save_graph(path, weights, judgments, nodes, aggregate):
+    with atomic_writer(path, compression='') as f:
+        np.savez_compressed(f, indptr=weights.indptr.astype(np.int64), indices=weights.indices.astype(np.int32),
+                            weights=weights.data.astype(np.float32), judgments=judgments.data.astype(np.int32),
+                            nodes=nodes, aggregate=np.array(aggregate))
+
+'''
+Loads a usage graph saved by save_graph().
+
+INPUT: (str), the path of the .npz file.
+OUTPUT: (scipy.sparse.csr_matrix, scipy.sparse.csr_matrix, numpy.ndarray), the weights, the numbers of judgments
+and the dataID of every row and column.
+'''
+def load_graph(path):
+    with np.load(path) as data:
+        n = len(data['nodes'])
+        weights = sparse.csr_matrix((data['weights'], data['indices'], data['indptr']), shape=(n, n))
+        judgments = sparse.csr_matrix((data['judgments'], data['indices'], data['indptr']), shape=(n, n))
+        return weights, judgments, data['nodes']
+
+'''
+Writes the edges of a usage graph as a .tsv edge list with one row per undirected edge: the two dataIDs, the weight
+and the number of judgments.
+
+INPUT: (str, scipy.sparse.csr_matrix, scipy.sparse.csr_matrix, numpy.ndarray), the path of the .tsv file, the
+weights, the numbers of judgments and the dataIDs.
+OUTPUT: (None)
+'''
+def write_edges(path, weights, judgments, nodes):
+    upper = sparse.triu(weights, format='coo')
+    counts = sparse.triu(judgments, format='csr')
+    df = pd.DataFrame({'dataID1': nodes[upper.row], 'dataID2': nodes[upper.col], 'weight': upper.data,
+                       'judgments': np.asarray(counts[upper.row, upper.col]).ravel()})
+    df = df.sort_values(['dataID1', 'dataID2'], kind='stable')
+    with atomic_writer(path) as f:
+        f.write(df.to_csv(sep='\t', quoting=csv.QUOTE_NONE, index=False).encode('utf-8'))
+
+'''
+Builds and exports the usage graph of one lemma folder. Folders without instances or judgments are skipped.
+
+INPUT: (str, str, str, list), a path to the lemma folder, the folder to write the graph to, the aggregate and the
+formats ('npz', 'tsv').
+OUTPUT: (tuple), the number of uses and edges, or None if the folder was skipped.
+'''
+def export_lemma(folder, out_folder, aggregate='median', formats=FORMATS):
+    if not all(exists(os.path.join(folder, name)) for name in ['uses.tsv', 'instances.tsv', 'judgments.tsv']):
+        return None
+    weights, judgments, nodes = build_graph(folder, aggregate)
+    os.makedirs(out_folder, exist_ok=True)
+    if 'npz' in formats:
+        save_graph(os.path.join(out_folder, GRAPH_NAME), weights, judgments, nodes, aggregate)
+    if 'tsv' in formats:
+        write_edges(os.path.join(out_folder, EDGES_NAME), weights, judgments, nodes)
+    return len(nodes), sparse.triu(weights).nnz
+
+def _export_lemma(args):
+    return export_lemma(*args)
+
+'''
+Builds the usage graphs of all lemma folders of a data directory in parallel, the largest lemmas first, and writes
+them to one folder per lemma in the output directory (e.g. graphs/<lemma>/graph.npz).
+
+INPUT: (str, str, str, list, int), a path to the data directory, the output directory, the aggregate, the formats
+and the number of worker processes.
+OUTPUT: (dict), the number of uses and edges of every exported lemma.
+'''
+def export_tree(path, out_path, aggregate='median', formats=FORMATS, jobs=1):
+    lemmas = [lemma for lemma, size in plan_lemmas(path, ['judgments.tsv'])]
+    tasks = [(os.path.join(path, lemma), os.path.join(out_path, lemma), aggregate, formats) for lemma in lemmas]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_export_lemma, tasks, chunksize=1))
+    else:
+        results = list(map(_export_lemma, tasks))
+    return {lemma: result for lemma, result in zip(lemmas, results) if result is not None}
+
+
+#*****************************************************************************
+# MAIN
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the weighted usage graph of every lemma from the use pair judgments of a data directory.')
+    parser.add_argument('data_directory', metavar='data_directory', type=str, help='Directory containing one folder per lemma (e.g. dwug_en/data)')
+    parser.add_argument('output_directory', metavar='output_directory', type=str, help='Directory to write one folder per lemma with its graph to')
+    parser.add_argument('--aggregate', choices=AGGREGATES, default='median', help='How the judgments of a pair of uses are aggregated into the edge weight (default: %(default)s)')
+    parser.add_argument('--formats', type=str, default=','.join(FORMATS), help=f'Comma-separated list of the formats to write, {GRAPH_NAME} and/or {EDGES_NAME} (default: %(default)s)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='Number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+
+    formats = [name.strip() for name in args.formats.split(',') if name.strip()]
+    unknown = [name for name in formats if name not in FORMATS]
+    if unknown:
+        parser.error(f"unknown format(s) {', '.join(unknown)}, choose from {', '.join(FORMATS)}")
+
+    start = time.perf_counter()
+    results = export_tree(args.data_directory, args.output_directory, args.aggregate, formats, args.jobs)
+    edges = sum(result[1] for result in results.values())
+    print(f'built {len(results)} usage graphs with {edges} edges in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
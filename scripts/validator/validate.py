@@ -0,0 +1,229 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog import plan_lemmas
+from compressed import existing_path, open_text
+from context_store import REF_COLUMN, find_store
+
+# The columns every table must have; further columns are allowed
+REQUIRED_COLUMNS = {
+    'uses.tsv': ['dataID', 'context', 'indices_target_token', 'indices_target_sentence', 'lemma'],
+    'senses.tsv': ['senseID', 'definition', 'lemma'],
+    'instances.tsv': ['instanceID', 'dataIDs', 'label_set', 'non_label'],
+    'judgments.tsv': ['instanceID', 'label', 'comment', 'annotator'],
+}
+
+# The tables a lemma folder must contain
+REQUIRED_FILES = ['uses.tsv', 'instances.tsv']
+
+SPAN_COLUMNS = ['indices_target_token', 'indices_target_sentence']
+
+#*****************************************************************************
+# READ THE TABLES
+
+'''
+Streams the rows of a table of a lemma folder. Rows with a different number of fields than the header and a
+header without the required columns are reported instead of being returned. Quoted fields are read like
+csv.DictReader reads them, e.g. contexts with quotes in the uses.tsv files written by convert_dwug.py.
+
+INPUT: (str, str, list), the lemma folder, the name of the table and the list to append violations to.
+OUTPUT: (iterator), the (line number, row dictionary) of every well-formed row.
+'''
+def read_rows(folder, file_name, violations):
+    path = existing_path(os.path.join(folder, file_name))
+    if path is None:
+        if file_name in REQUIRED_FILES:
+            violations.append((os.path.join(folder, file_name), None, 'missing file'))
+        return
+
+    with open_text(path) as f:
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader, None)
+        if header is None:
+            violations.append((path, None, 'empty file'))
+            return
+        # uses.tsv may reference its contexts in a context store instead of containing them
+        missing = [column for column in REQUIRED_COLUMNS[file_name]
+                   if column not in header and not (column == 'context' and REF_COLUMN in header)]
+        if missing:
+            violations.append((path, 1, f"missing column(s) {', '.join(missing)}"))
+            return
+        for row in reader:
+            if len(row) != len(header):
+                violations.append((path, reader.line_num, f'expected {len(header)} fields, found {len(row)}'))
+                continue
+            yield reader.line_num, dict(zip(header, row))
+
+#*****************************************************************************
+# CHECK THE VALUES
+
+'''
+Parses the spans of a use, e.g. '38:46' or '3:8,12:20' for a target of several tokens.
+
+INPUT: (str), the value of an indices column.
+OUTPUT: (list), the (start, end) pairs.
+'''
+def parse_spans(value):
+    spans = []
+    for span in value.split(','):
+        start, end = span.split(':')
+        spans.append((int(start), int(end)))
+    return spans
+
+'''
+Normalises a label for comparison, so that numeric labels match regardless of their notation (e.g. '3' and '3.0').
+
+INPUT: (str), a label.
+OUTPUT: (float or str), the number of a numeric label, the label itself otherwise.
+'''
+def normalise_label(label):
+    try:
+        return float(label)
+    except ValueError:
+        return label
+
+def check_spans(row, context, path, line, violations):
+    length = len(context)
+    for column in SPAN_COLUMNS:
+        try:
+            spans = parse_spans(row[column])
+        except ValueError:
+            violations.append((path, line, f"malformed {column} '{row[column]}'"))
+            continue
+        for start, end in spans:
+            if not 0 <= start <= end <= length:
+                violations.append((path, line, f"{column} {start}:{end} does not fit in a context of {length} characters"))
+
+'''
+Checks the tables of one lemma folder: every dataID and instanceID is unique, every dataIDs entry of instances.tsv
+is a dataID of uses.tsv or a senseID of senses.tsv, every instanceID of judgments.tsv is in instances.tsv, every
+label is in the label_set or the non_label of its instance (instances with an empty label_set, e.g. LEXSUB, accept
+any label) and the spans of every use fit in its context, which may be referenced in a context store. The tables
+are streamed and only the IDs are kept.
+
+INPUT: (str), a path to the lemma folder.
+OUTPUT: (list), the violations as (file, line, reason) triples; the line is None for violations of a whole file.
+'''
+def validate_lemma(folder):
+    violations = []
+
+    ids = {}
+    store = None
+    path = existing_path(os.path.join(folder, 'uses.tsv'))
+    for line, row in read_rows(folder, 'uses.tsv', violations):
+        if row['dataID'] in ids:
+            violations.append((path, line, f"duplicate dataID '{row['dataID']}' (first on line {ids[row['dataID']]})"))
+        ids[row['dataID']] = ids.get(row['dataID'], line)
+
+        context = row.get('context')
+        if context is None:
+            try:
+                store = store or find_store(path)
+                context = store.resolve([row[REF_COLUMN]])[0]
+            except FileNotFoundError as e:
+                violations.append((path, None, str(e)))
+                break
+            except (KeyError, ValueError):
+                violations.append((path, line, f"context '{row[REF_COLUMN]}' is not in the context store"))
+                continue
+        check_spans(row, context, path, line, violations)
+
+    for line, row in read_rows(folder, 'senses.tsv', violations):
+        ids.setdefault(row['senseID'], line)
+
+    # the allowed labels of every instance, shared between instances with the same label set
+    allowed = {}
+    label_sets = {}
+    path = existing_path(os.path.join(folder, 'instances.tsv'))
+    for line, row in read_rows(folder, 'instances.tsv', violations):
+        instance_id = row['instanceID']
+        if instance_id in allowed:
+            violations.append((path, line, f"duplicate instanceID '{instance_id}'"))
+        for data_id in row['dataIDs'].split(','):
+            if data_id not in ids:
+                violations.append((path, line, f"dataID '{data_id}' is not in uses.tsv or senses.tsv"))
+        key = (row['label_set'], row['non_label'])
+        if key not in label_sets:
+            labels = [label for label in row['label_set'].split(',') if label]
+            label_sets[key] = frozenset(map(normalise_label, labels + [row['non_label']])) if labels else None
+        allowed[instance_id] = key
+
+    path = existing_path(os.path.join(folder, 'judgments.tsv'))
+    for line, row in read_rows(folder, 'judgments.tsv', violations):
+        key = allowed.get(row['instanceID'])
+        if key is None:
+            violations.append((path, line, f"instanceID '{row['instanceID']}' is not in instances.tsv"))
+            continue
+        labels = label_sets[key]
+        if labels is not None and normalise_label(row['label']) not in labels:
+            violations.append((path, line, f"label '{row['label']}' is not in label_set '{key[0]}' or non_label '{key[1]}'"))
+
+    return violations
+
+'''
+Validates every lemma folder of a data directory, the largest lemmas first. The lemma folders are taken from the
+catalog of the data directory; a single lemma folder can be validated as well.
+
+INPUT: (str, int), a path to the data directory (or lemma folder) and the number of worker processes.
+OUTPUT: (dict), the violations of every lemma folder.
+'''
+def validate_tree(path, jobs=1):
+    if existing_path(os.path.join(path, 'uses.tsv')) and not any(
+            os.path.isdir(os.path.join(path, d)) for d in os.listdir(path)):
+        return {path: validate_lemma(path)}
+
+    folders = [os.path.join(path, lemma) for lemma, size in plan_lemmas(path)]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(validate_lemma, folders, chunksize=1)
+            return dict(zip(folders, results))
+    return {folder: validate_lemma(folder) for folder in folders}
+
+'''
+Prints the violations as 'file:line: reason', at most max_errors per file.
+
+INPUT: (dict, int), the violations of every lemma folder and the maximum number of violations printed per file
+(0 for all).
+OUTPUT: (int), the total number of violations.
+'''
+def print_violations(results, max_errors=0):
+    total = 0
+    for folder in sorted(results):
+        printed = {}
+        for path, line, reason in results[folder]:
+            total += 1
+            printed[path] = printed.get(path, 0) + 1
+            if max_errors and printed[path] > max_errors:
+                continue
+            print(f'{path}: {reason}' if line is None else f'{path}:{line}: {reason}')
+        for path, count in sorted(printed.items()):
+            if max_errors and count > max_errors:
+                print(f'{path}: ... {count - max_errors} more violations')
+    return total
+
+
+#*****************************************************************************
+# MAIN
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the references between the uses, senses, instances and judgments of a data directory, the labels of the judgments and the spans of the uses.')
+    parser.add_argument('data_directory', metavar='data_directory', type=str, help='Directory containing one folder per lemma (e.g. dwug_en/data), or a single lemma folder')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--max-errors', type=int, default=20, help='Maximum number of violations printed per file, 0 for all (default: %(default)s)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = validate_tree(args.data_directory, args.jobs)
+    total = print_violations(results, args.max_errors)
+    print(f'validated {len(results)} lemma folders in {time.perf_counter() - start:.1f}s, {total} violations', file=sys.stderr)
+    if total:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()